@@ -0,0 +1,91 @@
+""" Compares the size and decode speed of the compressed path encoding
+    (PathCodec) against the pickled list-of-dicts pathInfo that events
+    used to be saved with, and against the raw .npy path store.
+    
+    Usage:
+        python benchmarks/bench_path_codec.py
+        python benchmarks/bench_path_codec.py R1076D 0 0 TH1
+    
+    With no arguments a synthetic session is used, otherwise the
+    pathInfo of the given (subj, montage, session, exp).
+"""
+
+import sys
+import time
+import pickle
+
+import numpy as np
+
+from th_eventreader.PathStore import pack_paths
+from th_eventreader.PathCodec import (encode_paths, decode_paths,
+                                      compressors, zstandard)
+
+
+def synthetic_paths(n_events=400, n_samples=600, seed=0):
+    """ Makes a session's worth of paths: ~60Hz samples of a player
+        walking around with pauses, like playerPaths.par.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    mstime = 1_500_000_000_000
+    for i in range(n_events):
+        n = rng.integers(n_samples // 2, n_samples * 3 // 2)
+        times = mstime + np.cumsum(rng.integers(15, 19, n))
+        moving = rng.random(n) > 0.3
+        x = np.cumsum(moving * rng.normal(0, 0.2, n))
+        y = np.cumsum(moving * rng.normal(0, 0.2, n))
+        heading = np.mod(np.cumsum(moving * rng.normal(0, 2, n)), 360)
+        paths.append([{'mstime': int(t), 'x': float(a), 'y': float(b),
+                       'heading': float(h)}
+                      for t, a, b, h in zip(times, x, y, heading)])
+        mstime = int(times[-1]) + 5000
+    return paths
+
+
+def best_time(func, repeat=5):
+    """Returns the fastest of `repeat` runs of func, in seconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(args):
+    if args:
+        from th_eventreader import TH_EventReader as ereader
+        subj, montage, session, exp = args[0], int(args[1]), int(args[2]), args[3]
+        events = ereader.get_events(subj, montage, session, exp, cache=False)
+        paths = [list(path) for path in events['pathInfo']]
+    else:
+        paths = synthetic_paths()
+    arrays = pack_paths(paths)
+    n_samples = int(arrays['offsets'][-1])
+    print(f'{len(paths)} events, {n_samples} path samples\n')
+    
+    rows = []
+    pickled = pickle.dumps(paths, protocol=pickle.HIGHEST_PROTOCOL)
+    rows.append(('pickle (list of dicts)', len(pickled),
+                 best_time(lambda: pickle.loads(pickled))))
+    npy_bytes = sum(arr.nbytes for arr in arrays.values())
+    rows.append(('npy store (raw)', npy_bytes, np.nan))
+    
+    for compressor in compressors:
+        if compressor == 'zstd' and zstandard is None:
+            continue
+        for precision in (1e-3, 1e-2, None):
+            data = encode_paths(arrays, precision=precision,
+                                compressor=compressor)
+            name = f'{compressor}, ' + ('float32' if precision is None
+                                        else f'precision {precision:g}')
+            rows.append((name, len(data), best_time(lambda: decode_paths(data))))
+    
+    print(f"{'format':<28}{'bytes':>12}{'ratio':>8}{'decode ms':>11}{'Msamples/s':>12}")
+    for name, size, seconds in rows:
+        print(f'{name:<28}{size:>12,}{len(pickled) / size:>8.1f}'
+              f'{seconds * 1000:>11.2f}{n_samples / seconds / 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
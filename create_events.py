@@ -1,2 +1,2 @@
 from th_eventreader import TH_EventReader as ereader
-ereader.reload_all('TH1')
\ No newline at end of file
+ereader.run()
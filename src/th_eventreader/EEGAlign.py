@@ -0,0 +1,192 @@
+""" Converts the mstime windows of events (such as 'nav_start'/'nav_end'
+    and 'baseline_start'/'baseline_end' from `TH_EventReader.get_events`)
+    into EEG sample indices, for all events at once.
+    
+    Sample indices are counted from the start of each event's 'eegfile',
+    using its 'eegoffset' (the sample at the event's 'mstime') and the
+    sample rate of that file. The recording info of each file comes from
+    `get_file_info`, or can be passed in directly.
+"""
+
+import os
+import glob
+import json
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+#------Where cmlreaders keeps the recording info of a session
+sources_path = ('/protocols/r1/subjects/{subj}/experiments/{exp}'
+                '/sessions/{session}/ephys/current_processed/sources.json')
+
+
+def get_raw_file_info(eegfile):
+    """ Reads the sample rate and length of an old-style split EEG
+        recording (one file per channel, e.g. `eegfile`.001, with a
+        params.txt), as referenced by the matlab events.
+        
+        Returns:
+            (sample_rate, n_samples), NaN for whatever can't be found.
+    """
+    params = {}
+    for params_file in (eegfile + '.params.txt',
+                        os.path.join(os.path.dirname(eegfile), 'params.txt')):
+        if os.path.exists(params_file):
+            with open(params_file) as f:
+                for line in f:
+                    tokens = line.split()
+                    if len(tokens) == 2:
+                        params[tokens[0]] = tokens[1].strip("'\"")
+            break
+    sample_rate = float(params.get('samplerate', np.nan))
+    #------The length comes from the size of any of the channel files
+    itemsize = np.dtype(params.get('dataformat', 'int16')).itemsize
+    n_samples = np.nan
+    for channel_file in sorted(glob.glob(glob.escape(eegfile) + '.[0-9]*')):
+        n_samples = os.path.getsize(channel_file) // itemsize
+        break
+    return sample_rate, n_samples
+
+
+def get_cml_file_info(subj, exp, session):
+    """ Reads the sample rate and length of each EEG file of a session
+        from its sources.json, as referenced by the cmlreaders events.
+        
+        Returns:
+            dict of eegfile -> (sample_rate, n_samples)
+    """
+    fname = sources_path.format(subj=subj, exp=exp, session=session)
+    with open(fname) as f:
+        sources = json.load(f)
+    return {eegfile: (float(source['sample_rate']), source['n_samples'])
+            for eegfile, source in sources.items()}
+
+
+def get_file_info(events):
+    """ Finds the sample rate and length of every EEG file in events.
+        Files that can't be found get NaNs.
+        
+        Returns:
+            pd.DataFrame indexed by eegfile with columns
+                ['sample_rate', 'n_samples']
+    """
+    info = {}
+    eegfiles = events['eegfile'].drop_duplicates()
+    #------Full paths are old split recordings
+    for eegfile in eegfiles[eegfiles.map(os.path.isabs)]:
+        info[eegfile] = get_raw_file_info(eegfile)
+    #------Otherwise they are named in each session's sources.json,
+    #      which is under the subject alias for montages above 0
+    subj_col = 'subject_alias' if 'subject_alias' in events else 'subject'
+    session_cols = [subj_col, 'experiment', 'session']
+    others = ~events['eegfile'].isin(list(info))
+    if others.any() and all(col in events for col in session_cols):
+        sessions = events.loc[others, session_cols].drop_duplicates()
+        for (index, (subj, exp, session)) in sessions.iterrows():
+            try:
+                info.update(get_cml_file_info(subj, exp, session))
+            except (OSError, ValueError, KeyError) as e:
+                warnings.warn(f"Couldn't read the EEG sources of {subj} "
+                              f"{exp} session {session}: {e}")
+    info = pd.DataFrame.from_dict(info, orient='index',
+                                  columns=['sample_rate', 'n_samples'])
+    info = info.reindex(eegfiles.values).astype(float)
+    missing = info.index[info.isna().any(axis=1)]
+    if len(missing):
+        warnings.warn(f'No sample rate or length found for {len(missing)} '
+                      f'EEG file(s), their events will be invalid: '
+                      f'{list(missing)}')
+    return info
+
+
+def valid_eeg_events(events, file_info=None):
+    """ Checks which events have EEG that can be loaded: their eegfile
+        has a known sample rate and length, and their eegoffset is
+        inside the recording.
+        
+        Returns:
+            np.array of bools, one per event
+    """
+    if file_info is None:
+        file_info = get_file_info(events)
+    sample_rate = events['eegfile'].map(file_info['sample_rate']).values
+    n_samples = events['eegfile'].map(file_info['n_samples']).values
+    eegoffset = events['eegoffset'].values.astype(float)
+    with np.errstate(invalid='ignore'):
+        return ((sample_rate > 0) & (eegoffset >= 0)
+                & (eegoffset < n_samples))
+
+
+def align_windows(events, windows=('nav', 'baseline'), buffer_ms=0,
+                  file_info=None):
+    """ Converts mstime windows to EEG sample indices for all events.
+        
+        Args:
+            events (pd.DataFrame): with 'mstime', 'eegoffset', 'eegfile'
+                and '{window}_start'/'{window}_end' mstimes.
+            windows (list): names of the windows to align.
+            buffer_ms (float): time to add on both sides of each window.
+            file_info (pd.DataFrame): from `get_file_info`, which is
+                called if it isn't given.
+        
+        Returns:
+            pd.DataFrame indexed like events with, for each window,
+                '{window}_start_sample', '{window}_stop_sample': sample
+                    indices into the eegfile, clipped to the recording.
+                    The stop is exclusive.
+                '{window}_crosses_file' (bool): the buffered window runs
+                    off the start or end of its recording.
+                '{window}_valid' (bool): the events EEG can be loaded
+                    (see `valid_eeg_events`), the window has finite
+                    times and doesn't cross the file's boundaries.
+    """
+    if file_info is None:
+        file_info = get_file_info(events)
+    sample_rate = events['eegfile'].map(file_info['sample_rate']).values
+    n_samples = events['eegfile'].map(file_info['n_samples']).values
+    eegoffset = events['eegoffset'].values.astype(float)
+    mstime = events['mstime'].values.astype(float)
+    valid_eeg = valid_eeg_events(events, file_info)
+    
+    aligned = pd.DataFrame(index=events.index)
+    with np.errstate(invalid='ignore'):
+        for window in windows:
+            start_ms = events[f'{window}_start'].values.astype(float) - buffer_ms
+            end_ms = events[f'{window}_end'].values.astype(float) + buffer_ms
+            start = eegoffset + np.round((start_ms - mstime) * sample_rate / 1000)
+            stop = eegoffset + np.round((end_ms - mstime) * sample_rate / 1000)
+            finite = np.isfinite(start) & np.isfinite(stop) & (stop >= start)
+            crosses = finite & ((start < 0) | (stop > n_samples))
+            valid = valid_eeg & finite & ~crosses
+            #------Clip to the recording; windows that can't be
+            #      placed in one are left empty at sample 0
+            usable = valid_eeg & finite
+            start = np.where(usable, np.clip(start, 0, n_samples), 0)
+            stop = np.where(usable, np.clip(stop, 0, n_samples), 0)
+            aligned[f'{window}_start_sample'] = start.astype(np.int64)
+            aligned[f'{window}_stop_sample'] = stop.astype(np.int64)
+            aligned[f'{window}_crosses_file'] = crosses
+            aligned[f'{window}_valid'] = valid
+    return aligned
+
+
+def batch_reads(events, aligned, window):
+    """ Groups the valid windows by eegfile for batched EEG reads.
+        
+        Args:
+            events (pd.DataFrame)
+            aligned (pd.DataFrame): from `align_windows`.
+            window (str): which window to read, e.g. 'nav'.
+        
+        Returns:
+            dict of eegfile -> (event index, start array, stop array)
+    """
+    valid = aligned[f'{window}_valid']
+    reads = {}
+    for eegfile, locs in events[valid].groupby('eegfile').groups.items():
+        reads[eegfile] = (locs,
+                          aligned.loc[locs, f'{window}_start_sample'].values,
+                          aligned.loc[locs, f'{window}_stop_sample'].values)
+    return reads
@@ -0,0 +1,146 @@
+""" Framework for pulling per-trial timings out of a session's Log.txt
+    in one streaming pass.
+    
+    Each extractor is a `LogExtractor` subclass that lists the log
+    tokens it cares about. `extract_log` reads the log once and hands
+    every line containing one of those tokens to the extractors that
+    asked for it, then collects a per-trial table from each. Register
+    new extractors with `register_extractor` and they will be added to
+    the events by `TH_EventReader.get_log_fields` without another read
+    of the log. Example:
+    
+        @register_extractor
+        class RecallExtractor(LogExtractor):
+            name = 'recall'
+            tokens = ('RECALL_STARTED',)
+            
+            def __init__(self):
+                self.starts = []
+            
+            def feed(self, mstime, token, tokens):
+                self.starts.append(mstime)
+            
+            def table(self):
+                return pd.DataFrame({'recall_start': self.starts})
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+#------name -> LogExtractor subclass, in order of registration
+extractors = OrderedDict()
+
+
+class LogExtractor:
+    """ Base class for log extractors. A new instance is made for each
+        session, so state can be kept on self.
+        
+        Attributes:
+            name (str): Name used to register and request the extractor.
+            tokens (tuple): Log tokens that this extractor is fed.
+            dtypes (dict): Optional dtypes to cast the extracted
+                columns to once they are in the events.
+    """
+    name = None
+    tokens = ()
+    dtypes = {}
+    
+    def feed(self, mstime, token, tokens):
+        """ Called for each token in `tokens` found in the log.
+            
+            Args:
+                mstime (int): the mstime the line was logged at.
+                token (str): the token that matched.
+                tokens (list): all the tab-separated tokens of the line.
+        """
+        raise NotImplementedError
+    
+    def table(self):
+        """ Returns a pd.DataFrame with one row per trial, in trial
+            order, whose columns are added to the events.
+        """
+        raise NotImplementedError
+
+
+def register_extractor(cls):
+    """ Registers a LogExtractor subclass by its name so that it runs
+        whenever the log fields are extracted. Can be used as a class
+        decorator.
+    """
+    if not cls.name:
+        raise ValueError(f'{cls.__name__} needs a name to be registered')
+    extractors[cls.name] = cls
+    return cls
+
+
+def extract_log(log_file, names=None):
+    """ Reads a Log.txt once, feeding its lines to the extractors.
+        
+        Args:
+            log_file (str)
+            names (list): names of the registered extractors to run.
+                Defaults to all of them.
+        
+        Returns:
+            pd.DataFrame with one row per trial and the columns of all
+            the extractors' tables.
+    """
+    if names is None:
+        names = list(extractors)
+    running = [extractors[name]() for name in names]
+    #------Look up the extractors by token so each line is only
+    #      checked against a dict
+    by_token = {}
+    for extractor in running:
+        for token in extractor.tokens:
+            by_token.setdefault(token, []).append(extractor)
+    
+    with open(log_file, 'r') as f:
+        for line in f:
+            tokens = line.rstrip('\n').split('\t')
+            for token in tokens:
+                if token in by_token:
+                    mstime = int(tokens[0])
+                    for extractor in by_token[token]:
+                        extractor.feed(mstime, token, tokens)
+    
+    tables = [extractor.table() for extractor in running]
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, axis=1)
+
+
+@register_extractor
+class BaselineExtractor(LogExtractor):
+    """ Finds the start and end mstimes of the baseline period of each
+        trial. As defined in Miller et. al (2018), baseline periods for
+        TH are the time at the start of a trial before navigation.
+    """
+    name = 'baseline'
+    # whichever of these start tokens appears
+    # last before the nav will be the baseline start period
+    # this is because its a little inconsistent about which appears
+    start_tokens = ('HOMEBASE_TRANSPORT_ENDED',
+                    'HOMEBASE_TRANSPORT_STARTED',
+                    'SHOWING_INSTRUCTIONS')
+    tokens = start_tokens + ('TRIAL_NAVIGATION_STARTED',)
+    dtypes = {'baseline_start': int, 'baseline_end': int}
+    
+    def __init__(self):
+        self.current_start = np.nan
+        self.baseline_starts = []
+        self.baseline_ends = []
+    
+    def feed(self, mstime, token, tokens):
+        if token in self.start_tokens:
+            self.current_start = mstime
+        else:
+            self.baseline_ends.append(mstime)
+            self.baseline_starts.append(self.current_start)
+    
+    def table(self):
+        return pd.DataFrame({'baseline_start': self.baseline_starts,
+                             'baseline_end': self.baseline_ends})
@@ -6,6 +6,7 @@ import numpy as np
 import pandas as pd
 import scipy.io as sio
 from matplotlib import pyplot as plt
+from th_eventreader.EEGAlign import get_file_info, valid_eeg_events
 
 
 def get_events_path(subj, montage=0, exp='TH1'):
@@ -92,6 +93,8 @@ def last_valid_event(subj):
     """ Some of these subjects can't load eeg from event X and on. 
         I'm not really sure what the deal is, but this tells you what
         event is the last valid event for loading eeg for that subject.
+        Only used when the eeg files aren't around to check the events
+        against (see `EEGAlign.valid_eeg_events`).
     """
     subj_event_pairs = (('R1154D', 780), ('R1167M', 260), ('R1180C', 522),
                         ('R1190P', 241), ('R1191J', 780), ('R1192C', 261),
@@ -114,9 +117,19 @@ def get_events_from_mat(subj, montage, exp):
     #      (not really sure what's up with this, but some just have
     #      an empty list ([]) instead of a str file name)
     events = events[[type(i)==str for i in events['eegfile']]]
-    #------Exclude events that don't work with loading eeg 
-    if last_valid_event(subj) is not None:
-        events = events[:last_valid_event(subj)-1]
+    #------Exclude events that don't work with loading eeg, checking
+    #      against their eeg files where they can be found and falling
+    #      back on the known cutoffs (if any) where they can't
+    file_info = get_file_info(events)
+    known = events['eegfile'].map(file_info.notna().all(axis=1))
+    known = known.values.astype(bool)
+    valid = valid_eeg_events(events, file_info)
+    cutoff = last_valid_event(subj)
+    if cutoff is not None:
+        before_cutoff = np.arange(len(events)) < cutoff - 1
+    else:
+        before_cutoff = np.ones(len(events), dtype=bool)
+    events = events[np.where(known, valid, before_cutoff)].copy()
     #------Convert the pathData into the list-dict format
     mat_pathData_to_list(events)
     #------Done!
@@ -0,0 +1,211 @@
+""" Compressed encoding of a session's path data, for when disk space
+    and cold reads over NFS matter more than memory-mapping (see
+    PathStore).
+    
+    Sample times are delta encoded and the positions and headings are
+    quantized to a fixed precision (or stored as float32) and delta
+    encoded too. Streams that can't be quantized, because they hold
+    NaNs, infs or values too big for int64 at that precision, are
+    stored as float32. The resulting small integers are written as zigzag
+    varints and the whole thing is block compressed with zlib, lzma or,
+    if the zstandard package is installed, zstd. Decoding is vectorized
+    straight into numpy arrays.
+"""
+
+import os
+import json
+import lzma
+import zlib
+
+import numpy as np
+
+from th_eventreader.PathStore import PathStore, pack_paths, path_dtypes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+magic = b'THPC'
+version = 2 # 2 added per stream float32 fallbacks
+compressors = ('zstd', 'lzma', 'zlib')
+default_compressor = 'zstd' if zstandard is not None else 'zlib'
+default_precision = 1e-3
+# quantized values are kept under this so their deltas fit in an int64
+max_quantized = 2.0**62
+
+
+def _compress(data, compressor, level):
+    if compressor == 'zlib':
+        return zlib.compress(data, 6 if level is None else level)
+    if compressor == 'lzma':
+        return lzma.compress(data, preset=6 if level is None else level)
+    if compressor == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package')
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    raise ValueError(f'Unknown compressor {compressor!r}, use one of {compressors}')
+
+
+def _decompress(data, compressor):
+    if compressor == 'zlib':
+        return zlib.decompress(data)
+    if compressor == 'lzma':
+        return lzma.decompress(data)
+    if compressor == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'Unknown compressor {compressor!r}, use one of {compressors}')
+
+
+def zigzag(values):
+    """Maps int64s to uint64s so that small negatives stay small."""
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    """Inverse of `zigzag`."""
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).view(np.int64)
+            ^ -(values & np.uint64(1)).view(np.int64))
+
+
+def encode_varints(values):
+    """ Encodes uint64s as LEB128 varints: 7 bits per byte, with the
+        high bit set on every byte but the last of each value.
+        
+        Returns:
+            np.array of uint8
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        n_bytes += values >= np.uint64(1 << (7*k))
+    starts = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(n_bytes[:-1], out=starts[1:])
+    out = np.zeros(n_bytes.sum(), dtype=np.uint8)
+    for k in range(int(n_bytes.max(initial=0))):
+        has_byte = n_bytes > k
+        byte = (values[has_byte] >> np.uint64(7*k)) & np.uint64(0x7f)
+        more = (n_bytes[has_byte] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[has_byte] + k] = byte | more
+    return out
+
+
+def decode_varints(data):
+    """ Decodes a uint8 array of varints from `encode_varints`.
+        
+        Returns:
+            np.array of uint64
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    ends = data < 0x80
+    starts = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+    group = np.cumsum(np.concatenate([[0], ends[:-1]]))
+    shift = (np.arange(len(data)) - starts[group]) * 7
+    chunks = (data & 0x7f).astype(np.uint64) << shift.astype(np.uint64)
+    return np.bitwise_or.reduceat(chunks, starts)
+
+
+def encode_paths(arrays, precision=default_precision,
+                 compressor=default_compressor, level=None):
+    """ Encodes a session's path arrays into bytes.
+        
+        Args:
+            arrays (dict): from `PathStore.pack_paths`.
+            precision (float): step that x, y and heading are rounded
+                to. If None they are stored as float32 instead, as is
+                any of them that can't be rounded to it.
+            compressor (str): 'zstd', 'lzma' or 'zlib'.
+            level (int): compression level, or None for the default.
+        
+        Returns:
+            bytes
+    """
+    streams = [encode_varints(np.diff(arrays['offsets'])),
+               encode_varints(zigzag(np.diff(arrays['mstime'], prepend=0)))]
+    float32_keys = []
+    for key in ['x', 'y', 'heading']:
+        if precision is not None:
+            with np.errstate(invalid='ignore', over='ignore'):
+                quantized = np.round(np.asarray(arrays[key]) * (1 / precision))
+            if (np.isfinite(quantized).all()
+                and (np.abs(quantized) < max_quantized).all()):
+                streams.append(encode_varints(zigzag(np.diff(quantized, prepend=0))))
+                continue
+        float32_keys.append(key)
+        streams.append(np.asarray(arrays[key], dtype='<f4').view(np.uint8))
+    header = json.dumps({
+        'version': version, 'compressor': compressor, 'precision': precision,
+        'float32_keys': float32_keys,
+        'n_events': len(arrays['offsets']) - 1,
+        'n_samples': int(arrays['offsets'][-1]),
+        'stream_bytes': [len(stream) for stream in streams],
+    }).encode()
+    payload = _compress(np.concatenate(streams).tobytes(), compressor, level)
+    return (magic + len(header).to_bytes(4, 'little') + header + payload)
+
+
+def decode_paths(data):
+    """ Decodes bytes from `encode_paths`.
+        
+        Returns:
+            dict of 'offsets' and the `PathStore.path_dtypes` arrays.
+    """
+    if data[:4] != magic:
+        raise ValueError('Not an encoded path file')
+    header_len = int.from_bytes(data[4:8], 'little')
+    header = json.loads(data[8:8+header_len])
+    if header['version'] > version:
+        raise ValueError(f"Path encoding version {header['version']} is newer "
+                         f"than this reader's ({version})")
+    payload = np.frombuffer(_decompress(data[8+header_len:], header['compressor']),
+                            dtype=np.uint8)
+    bounds = np.cumsum([0] + header['stream_bytes'])
+    streams = [payload[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    
+    offsets = np.zeros(header['n_events'] + 1, dtype='<i8')
+    np.cumsum(decode_varints(streams[0]).astype(np.int64), out=offsets[1:])
+    arrays = {'offsets': offsets,
+              'mstime': np.cumsum(unzigzag(decode_varints(streams[1])))}
+    precision = header['precision']
+    float32_keys = header.get('float32_keys', ['x', 'y', 'heading']
+                              if precision is None else [])
+    for key, stream in zip(['x', 'y', 'heading'], streams[2:]):
+        if key in float32_keys:
+            arrays[key] = stream.view('<f4')
+        else:
+            arrays[key] = np.cumsum(unzigzag(decode_varints(stream))) / (1 / precision)
+    for key, dtype in path_dtypes.items():
+        if key not in float32_keys:
+            arrays[key] = arrays[key].astype(dtype, copy=False)
+    for arr in arrays.values():
+        arr.flags.writeable = False
+    return arrays
+
+
+def save_compressed_paths(paths, fname, **kwargs):
+    """ Saves the paths of a session's events encoded in one file.
+        Keyword args are passed to `encode_paths`.
+        
+        Returns:
+            the offsets index of the paths
+    """
+    arrays = pack_paths(paths)
+    data = encode_paths(arrays, **kwargs)
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp_fname, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_fname, fname)
+    return arrays['offsets']
+
+
+def load_compressed_paths(fname):
+    """Loads the file from `save_compressed_paths` as a PathStore."""
+    with open(fname, 'rb') as f:
+        return PathStore(decode_paths(f.read()))
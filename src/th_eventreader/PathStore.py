@@ -0,0 +1,184 @@
+""" Binary storage of events' path data.
+    
+    The path samples of a whole session are saved as one little-endian
+    .npy array of ('mstime', 'x', 'y', 'heading') records, plus an
+    'offsets' index where event i's samples are offsets[i]:offsets[i+1].
+    Loading np.memmaps the samples, so opening a session is instant,
+    each event's path is a zero-copy slice that is only read from disk
+    when used, and processes on the same node share the pages through
+    the OS cache. Each open session costs one mapping (and so one open
+    file descriptor); the small offsets index is read into memory.
+"""
+
+import os
+import zlib
+import errno
+import shutil
+import itertools
+from collections.abc import Sequence
+
+import numpy as np
+
+
+#------Keys of a path datapoint and how they are stored
+path_dtypes = {'mstime': '<i8', 'x': '<f8', 'y': '<f8', 'heading': '<f8'}
+sample_dtype = np.dtype(list(path_dtypes.items()))
+
+
+class EventPath(Sequence):
+    """ The path of one event, backed by numpy arrays. Acts like the
+        usual list of {'mstime', 'x', 'y', 'heading'} dicts, but the
+        arrays can also be used directly, e.g. `path.x`.
+    """
+    
+    def __init__(self, mstime, x, y, heading):
+        self.mstime = mstime
+        self.x = x
+        self.y = y
+        self.heading = heading
+    
+    def __len__(self):
+        return len(self.mstime)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {'mstime': int(self.mstime[i]), 'x': float(self.x[i]),
+                'y': float(self.y[i]), 'heading': float(self.heading[i])}
+    
+    def __iter__(self):
+        for point in zip(self.mstime.tolist(), self.x.tolist(),
+                         self.y.tolist(), self.heading.tolist()):
+            yield dict(zip(path_dtypes, point))
+    
+    def __repr__(self):
+        return f'EventPath({len(self)} points)'
+    
+    def __reduce__(self):
+        # pickle as the plain list of dicts, so saved events
+        # don't depend on the store being around
+        return (list, (list(self),))
+    
+    @property
+    def nbytes(self):
+        """Bytes of process memory held, not counting memmapped data."""
+        return sum(arr.nbytes for arr in (self.mstime, self.x, self.y, self.heading)
+                   if not isinstance(arr, np.memmap))
+
+
+class PathStore:
+    """ The paths of all the events of a session.
+        
+        Args:
+            arrays (dict): 'offsets' and the `path_dtypes` arrays.
+    """
+    
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.offsets = arrays['offsets']
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i):
+        start, stop = self.offsets[i], self.offsets[i+1]
+        return EventPath(*(self.arrays[key][start:stop] for key in path_dtypes))
+    
+    def paths(self):
+        """Returns a list with the EventPath of every event."""
+        return [self[i] for i in range(len(self))]
+    
+    def checksum(self):
+        """See `offsets_checksum`."""
+        return offsets_checksum(self.offsets)
+
+
+def offsets_checksum(offsets):
+    """ Returns a checksum of a store's offsets index, saved with the
+        events to check that they were saved with the same paths.
+    """
+    return zlib.crc32(np.ascontiguousarray(offsets, dtype='<i8').tobytes())
+
+
+def pack_paths(paths):
+    """ Flattens a sequence of event paths into the store's arrays.
+        
+        Args:
+            paths: the 'pathInfo' of the events. Each path is a list of
+                {'mstime', 'x', 'y', 'heading'} dicts or an EventPath.
+        
+        Returns:
+            dict of 'offsets' and the `path_dtypes` arrays.
+    """
+    lengths = np.array([len(path) for path in paths], dtype='<i8')
+    offsets = np.zeros(len(lengths) + 1, dtype='<i8')
+    np.cumsum(lengths, out=offsets[1:])
+    arrays = {'offsets': offsets}
+    if all(isinstance(path, EventPath) for path in paths):
+        # already arrays, e.g. loaded from a store
+        for key, dtype in path_dtypes.items():
+            arrays[key] = np.concatenate(
+                [np.zeros(0, dtype=dtype)]
+                + [getattr(path, key) for path in paths]).astype(dtype, copy=False)
+        return arrays
+    for key, dtype in path_dtypes.items():
+        arrays[key] = np.fromiter(
+            (point[key] for path in paths for point in path),
+            dtype=dtype, count=offsets[-1])
+    return arrays
+
+
+def save_paths(paths, path_dir):
+    """ Saves the paths of a session's events as a store in path_dir.
+        The store is written next to path_dir and then moved into
+        place, so readers never see a half written one. An old store
+        is moved aside first and only deleted once the new one is in.
+        
+        Returns:
+            the offsets index of the store
+    """
+    arrays = pack_paths(paths)
+    samples = np.empty(arrays['offsets'][-1], dtype=sample_dtype)
+    for key in path_dtypes:
+        samples[key] = arrays[key]
+    path_dir = path_dir.rstrip('/')
+    tmp_dir = f'{path_dir}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), arrays['offsets'])
+    np.save(os.path.join(tmp_dir, 'samples.npy'), samples)
+    old_dir = f'{path_dir}.{os.getpid()}.old'
+    os.makedirs(old_dir, exist_ok=True)
+    for i in itertools.count():
+        try:
+            os.replace(path_dir, os.path.join(old_dir, str(i)))
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp_dir, path_dir)
+            break
+        except OSError as e:
+            # another writer put its store in between our two moves
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+    shutil.rmtree(old_dir)
+    return arrays['offsets']
+
+
+def load_paths(path_dir, mmap=True):
+    """ Opens the store saved in path_dir.
+        
+        Args:
+            path_dir (str)
+            mmap (bool): If True, the arrays are memory-mapped read-only
+                instead of read into memory.
+        
+        Returns:
+            PathStore
+    """
+    samples = np.load(os.path.join(path_dir, 'samples.npy'),
+                      mmap_mode='r' if mmap else None)
+    samples.flags.writeable = False
+    arrays = {key: samples[key] for key in path_dtypes}
+    arrays['offsets'] = np.load(os.path.join(path_dir, 'offsets.npy'))
+    arrays['offsets'].flags.writeable = False
+    return PathStore(arrays)
@@ -0,0 +1,135 @@
+""" An in-process, memory-bounded cache of loaded events, so that
+    sessions asked for over and over aren't re-read from disk each time.
+    TH_EventReader keeps one of these as `session_cache`.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from th_eventreader.PathStore import PathStore, pack_paths
+
+
+def events_nbytes(events):
+    """ Estimates how many bytes an events df takes up in memory.
+        `DataFrame.memory_usage` only sees the outer lists of the
+        'pathInfo' column, so the path samples are counted here.
+    """
+    nbytes = int(events.memory_usage(deep=True).sum())
+    if 'pathInfo' in events:
+        for path in events['pathInfo']:
+            if isinstance(path, list):
+                for point in path:
+                    nbytes += sys.getsizeof(point)
+                    nbytes += sum(sys.getsizeof(v) for v in point.values())
+            elif hasattr(path, 'nbytes'):
+                nbytes += int(path.nbytes)
+    return nbytes
+
+
+def freeze_events(events):
+    """ Returns a copy of events to keep in the cache. The path samples
+        are packed into read-only arrays (so they are held in memory,
+        not in open mmaps) and each 'pathInfo' entry becomes a
+        read-only EventPath over them, which can be shared by every
+        copy handed out without being changed through any of them.
+    """
+    events = events.copy(deep=True)
+    if 'pathInfo' in events:
+        arrays = pack_paths(list(events['pathInfo']))
+        for array in arrays.values():
+            array.flags.writeable = False
+        events['pathInfo'] = PathStore(arrays).paths()
+    return events
+
+
+class SessionCache:
+    """ Least-recently-used cache of events dfs, keyed by
+        (subj, montage, session, exp), that holds at most max_bytes
+        worth of events (as measured by `events_nbytes`).
+        
+        Callers always get their own copy of the cached events' columns,
+        so changing them can't corrupt the cache. The paths are not
+        copied: 'pathInfo' holds read-only EventPaths shared with the
+        cache (see `freeze_events`), so a hit costs one copy of the
+        columns and never a walk over the samples.
+        
+        Args:
+            max_bytes (int): memory budget. 0 turns the cache off.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (events, nbytes)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def get(self, key):
+        """Returns a copy of the cached events for key, or None."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            events = self._entries[key][0]
+        return events.copy(deep=True)
+    
+    def put(self, key, events):
+        """ Caches a copy of events under key, evicting the least
+            recently used sessions to stay in budget. Sessions bigger
+            than the whole budget are not cached.
+        """
+        events = freeze_events(events)
+        nbytes = events_nbytes(events) # memmapped paths are in memory now
+        if nbytes > self.max_bytes:
+            self.invalidate(key)
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            while self._entries and self.nbytes + nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+            self._entries[key] = (events, nbytes)
+            self.nbytes += nbytes
+    
+    def invalidate(self, key):
+        """Drops key from the cache if it is there."""
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+    
+    def clear(self):
+        """Empties the cache. The hit/miss counts are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+    
+    def resize(self, max_bytes):
+        """Changes the memory budget, evicting sessions if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._entries and self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+    
+    def stats(self):
+        """Returns a dict of the cache's size and hit/miss counts."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else np.nan}
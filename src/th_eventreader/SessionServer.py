@@ -0,0 +1,495 @@
+""" A local session server that loads each session once and shares it
+    with every analysis process on the node through shared memory.
+    
+    The server keeps the numeric columns and the path arrays of the
+    sessions it has loaded in `multiprocessing.shared_memory` blocks.
+    Clients map those blocks and build their events on top of them
+    without copying, so N processes looking at the same session only
+    hold it in RAM once. Sessions that no client is using are evicted,
+    least recently used first, once the server's memory budget is hit.
+    
+    Start the server (e.g. in the background on the node):
+        
+        th_session_server --max-mb 20000
+    
+    Then in the analysis code:
+        
+        from th_eventreader import SessionServer
+        events = SessionServer.get_events('R1076D', 0, 0, 'TH1')
+        ...
+        SessionServer.release('R1076D', 0, 0, 'TH1')
+    
+    where get_events falls back to `TH_EventReader.get_events` if no server is
+    running.
+    
+    Clients authenticate with a random key that the server keeps in a
+    file only its user can read, next to its socket (see `get_authkey`).
+"""
+
+import os
+import sys
+import mmap
+import pickle
+import signal
+import socket
+import argparse
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory, AuthenticationError
+from multiprocessing.managers import BaseManager
+
+try:
+    # the POSIX shared memory calls that SharedMemory itself uses
+    import _posixshmem
+except ImportError:
+    _posixshmem = None
+
+import numpy as np
+import pandas as pd
+
+from th_eventreader.PathStore import PathStore, pack_paths
+
+
+default_address = os.environ.get(
+    'TH_SESSION_SERVER', f'/tmp/th_session_server_{os.getuid()}.sock')
+#------Column dtypes that are shared as arrays; everything else is pickled
+shared_kinds = 'biufcmM'
+alignment = 64
+
+
+def pack_session(events):
+    """ Lays out a session's events in one shared memory block.
+        
+        Returns:
+            (SharedMemory, layout) where layout is a dict describing
+            where each column and path array is in the block.
+    """
+    arrays = OrderedDict()
+    object_cols = []
+    for col in events.columns:
+        if col == 'pathInfo':
+            continue
+        values = events[col].values
+        if isinstance(values, np.ndarray) and values.dtype.kind in shared_kinds:
+            arrays[('column', col)] = values
+        else:
+            object_cols.append(col)
+    if 'pathInfo' in events:
+        for key, arr in pack_paths(list(events['pathInfo'])).items():
+            arrays[('path', key)] = arr
+    objects = np.frombuffer(
+        pickle.dumps(events[object_cols], protocol=pickle.HIGHEST_PROTOCOL),
+        dtype=np.uint8)
+    arrays[('objects', None)] = objects
+    
+    #------Place the arrays one after the other, aligned
+    layout = {'columns': list(events.columns), 'arrays': []}
+    offset = 0
+    for (kind, name), arr in arrays.items():
+        layout['arrays'].append((kind, name, arr.dtype.str, offset, len(arr)))
+        offset += -(-arr.nbytes // alignment) * alignment
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (kind, name, dtype, offset, length), arr in zip(layout['arrays'],
+                                                        arrays.values()):
+        np.ndarray(length, dtype, shm.buf, offset)[:] = arr
+    layout['name'] = shm.name
+    layout['nbytes'] = shm.size
+    return shm, layout
+
+
+def unpack_session(buf, layout):
+    """ Builds the events df on top of a block from `pack_session`,
+        without copying the shared arrays.
+    """
+    columns = {}
+    paths = {}
+    for kind, name, dtype, offset, length in layout['arrays']:
+        arr = np.ndarray(length, dtype, buf, offset)
+        if kind == 'column':
+            columns[name] = arr
+        elif kind == 'path':
+            paths[name] = arr
+        else:
+            objects = pickle.loads(arr.tobytes())
+    data = {}
+    for col in layout['columns']:
+        if col == 'pathInfo':
+            data[col] = PathStore(paths).paths()
+        elif col in columns:
+            data[col] = columns[col]
+        else:
+            data[col] = objects[col].values
+    return pd.DataFrame(data, index=objects.index, copy=False)
+
+
+def process_id(pid=None):
+    """ Identifies a process on this node by its pid and, where /proc
+        has it, its start time, so a reused pid isn't mistaken for it.
+        
+        Returns:
+            (pid, start time or None)
+    """
+    pid = os.getpid() if pid is None else pid
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # the command name in brackets can contain spaces
+            return pid, int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return pid, None
+
+
+def process_alive(client):
+    """Checks if the process identified by `process_id` is still around."""
+    pid, start = client
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return start is None or process_id(pid) == (pid, start)
+
+
+class SessionBroker:
+    """ Keeps the shared sessions on the server side. Each client
+        process that acquires a session holds a reference to it until it
+        releases it, and only unreferenced sessions are evicted. The
+        references of client processes that have exited (or were killed)
+        without releasing are dropped before evicting.
+        
+        Args:
+            max_bytes (int): memory budget for the shared sessions. It
+                can be exceeded while every session is in use.
+            loader: called as loader(subj, montage, session, exp) to
+                load sessions. Defaults to `TH_EventReader.get_events`.
+    """
+    
+    def __init__(self, max_bytes, loader=None):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self._sessions = OrderedDict() # key -> [shm, layout, {client: refs}]
+        self._loading = {} # key -> threading.Event
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+    
+    def _load(self, key):
+        if self.loader is not None:
+            return self.loader(*key)
+        from th_eventreader import TH_EventReader
+        return TH_EventReader.get_events(*key, cache=False)
+    
+    def acquire(self, key, client):
+        """ Returns the layout of the session for key, loading it first
+            if needed, and counts a reference to it for client (from
+            `process_id`).
+        """
+        key = tuple(key)
+        client = tuple(client)
+        while True:
+            with self._lock:
+                if key in self._sessions:
+                    refs = self._sessions[key][2]
+                    refs[client] = refs.get(client, 0) + 1
+                    self._sessions.move_to_end(key)
+                    return self._sessions[key][1]
+                loading = self._loading.get(key)
+                if loading is None:
+                    self._loading[key] = threading.Event()
+                    break
+            # someone else is loading it, wait and look again
+            loading.wait()
+        try:
+            shm, layout = pack_session(self._load(key))
+            with self._lock:
+                self._sessions[key] = [shm, layout, {client: 1}]
+                self.loads += 1
+                self._evict()
+            return layout
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+    
+    def release(self, key, client):
+        """Drops one of client's references to the session for key."""
+        key = tuple(key)
+        client = tuple(client)
+        with self._lock:
+            if key in self._sessions:
+                refs = self._sessions[key][2]
+                if refs.get(client, 0) > 1:
+                    refs[client] -= 1
+                else:
+                    refs.pop(client, None)
+                self._evict()
+    
+    def _prune(self):
+        """Drops the references of exited clients. Needs the lock."""
+        clients = {client for entry in self._sessions.values()
+                   for client in entry[2]}
+        dead = {client for client in clients if not process_alive(client)}
+        if dead:
+            for entry in self._sessions.values():
+                for client in dead & set(entry[2]):
+                    del entry[2][client]
+    
+    def _evict(self):
+        """Evicts unreferenced sessions until in budget. Needs the lock."""
+        nbytes = sum(entry[1]['nbytes'] for entry in self._sessions.values())
+        if nbytes <= self.max_bytes:
+            return
+        self._prune()
+        for key in list(self._sessions):
+            if nbytes <= self.max_bytes:
+                break
+            shm, layout, refs = self._sessions[key]
+            if not refs:
+                del self._sessions[key]
+                nbytes -= layout['nbytes']
+                # clients that still have it mapped keep their pages
+                shm.close()
+                shm.unlink()
+                self.evictions += 1
+    
+    def stats(self):
+        """Returns a dict of what the server is holding."""
+        with self._lock:
+            self._prune()
+            return {'sessions': {key: sum(entry[2].values()) for key, entry
+                                 in self._sessions.items()},
+                    'nbytes': sum(entry[1]['nbytes'] for entry
+                                  in self._sessions.values()),
+                    'max_bytes': self.max_bytes, 'loads': self.loads,
+                    'evictions': self.evictions}
+    
+    def shutdown(self):
+        """Unlinks all the shared blocks."""
+        with self._lock:
+            for shm, layout, refs in self._sessions.values():
+                shm.close()
+                shm.unlink()
+            self._sessions.clear()
+
+
+def get_authkey(address=None, create=False):
+    """ Returns the key that clients of the server at address use to
+        authenticate: $TH_SESSION_SERVER_KEY if it is set, or else the
+        key in the file `address + '.key'`.
+        
+        Args:
+            create (bool): if the file doesn't exist (or isn't private
+                to this user), write a new random key to it first. Used
+                by the server.
+        
+        Raises:
+            FileNotFoundError if there is no key file and not create.
+            PermissionError if the key file is another user's.
+    """
+    if 'TH_SESSION_SERVER_KEY' in os.environ:
+        return os.environ['TH_SESSION_SERVER_KEY'].encode()
+    fname = (address or default_address) + '.key'
+    if create:
+        try:
+            info = os.stat(fname)
+            private = info.st_uid == os.getuid() and not info.st_mode & 0o077
+        except FileNotFoundError:
+            private = False
+        if not private:
+            # written aside and moved into place, so clients never
+            # read half a key
+            tmp_fname = f'{fname}.{os.getpid()}.tmp'
+            fd = os.open(tmp_fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(32).hex().encode())
+            os.replace(tmp_fname, fname)
+    if os.stat(fname).st_uid != os.getuid():
+        raise PermissionError(f'{fname} belongs to another user')
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+class SessionManager(BaseManager):
+    pass
+
+
+SessionManager.register('broker')
+
+
+def attach(layout):
+    """ Maps the shared block of a session read-only. Unlike
+        SharedMemory, the mapping lives as long as anything (such as the
+        arrays built on it) references it, and this process's resource
+        tracker doesn't unlink it on exit. (SharedMemory(track=False)
+        would still unmap the block under live arrays when it is
+        garbage collected.)
+    """
+    if _posixshmem is None:
+        raise RuntimeError('The session server needs POSIX shared memory, '
+                           'which this platform does not have')
+    fd = _posixshmem.shm_open('/' + layout['name'], os.O_RDONLY, mode=0o600)
+    try:
+        return mmap.mmap(fd, layout['nbytes'], prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+
+class SessionClient:
+    """ Connection to a running session server.
+        
+        Args:
+            address (str): the server's socket. Defaults to
+                `default_address`.
+            authkey (bytes): defaults to `get_authkey(address)`.
+        
+        Raises:
+            OSError if no server is running at address.
+            multiprocessing.AuthenticationError if authkey is wrong.
+    """
+    
+    def __init__(self, address=None, authkey=None):
+        self.manager = SessionManager(address or default_address,
+                                      authkey or get_authkey(address))
+        self.manager.connect()
+        self.broker = self.manager.broker()
+        self._held = {} # key -> number of unreleased get_events
+        self._lock = threading.Lock()
+    
+    def get_events(self, subj, montage, session, exp):
+        """ Returns the events of a session from the server, like
+            `TH_EventReader.get_events`. The shared columns and paths
+            are read-only; copy the df to change them. Call `release`
+            once done with the events to let the server evict them.
+        """
+        key = (subj, int(montage), int(session), exp)
+        layout = self.broker.acquire(key, process_id())
+        with self._lock:
+            self._held[key] = self._held.get(key, 0) + 1
+        return unpack_session(attach(layout), layout)
+    
+    def release(self, subj, montage, session, exp):
+        """ Tells the server that one get_events of a session is done
+            with. Events still around keep their mapping of it.
+        """
+        key = (subj, int(montage), int(session), exp)
+        with self._lock:
+            if not self._held.get(key):
+                return
+            self._held[key] -= 1
+            if not self._held[key]:
+                del self._held[key]
+        self.broker.release(key, process_id())
+    
+    def close(self):
+        """Releases all the sessions this client holds."""
+        for key, refs in list(self._held.items()):
+            for i in range(refs):
+                self.release(*key)
+    
+    def stats(self):
+        return self.broker.stats()
+
+
+#------(pid, address, authkey) -> SessionClient, so that the client
+#      that got a session is the one that releases it
+_clients = {}
+
+
+def get_client(address=None, authkey=None):
+    """ Returns this process's SessionClient for the server at address,
+        connecting the first time, or None if no server is running.
+    """
+    key = (os.getpid(), address or default_address, authkey)
+    if key not in _clients:
+        try:
+            _clients[key] = SessionClient(address, authkey)
+        except (OSError, AuthenticationError):
+            return None
+    return _clients[key]
+
+
+def get_events(subj, montage, session, exp, address=None, authkey=None):
+    """ Returns the events of a session from the session server, or
+        loads them directly with `TH_EventReader.get_events` if the
+        server isn't running.
+    """
+    client = get_client(address, authkey)
+    if client is not None:
+        try:
+            return client.get_events(subj, montage, session, exp)
+        except (EOFError, ConnectionError):
+            # the server went away since we connected
+            _clients.pop((os.getpid(), address or default_address,
+                          authkey), None)
+    from th_eventreader import TH_EventReader
+    return TH_EventReader.get_events(subj, montage, session, exp)
+
+
+def release(subj, montage, session, exp, address=None, authkey=None):
+    """ Lets the server evict a session from `get_events` once this
+        process is done with it. Does nothing if no server is running.
+    """
+    client = get_client(address, authkey)
+    if client is not None:
+        client.release(subj, montage, session, exp)
+
+
+def server_running(address=None):
+    """ Checks if a server is listening at address, rather than it
+        being a socket left behind by one that didn't shut down cleanly.
+    """
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(address or default_address)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def serve(address=None, authkey=None, max_bytes=8 * 2**30, loader=None):
+    """ Runs a session server until interrupted.
+        
+        Args:
+            address (str): socket to listen on.
+            authkey (bytes): defaults to `get_authkey(address)`, creating
+                the key file if needed.
+            max_bytes (int): memory budget for the shared sessions.
+            loader: how to load sessions, see `SessionBroker`.
+        
+        Raises:
+            RuntimeError if a server is already running at address.
+    """
+    address = address or default_address
+    if server_running(address):
+        raise RuntimeError(f'A session server is already running at {address}')
+    if os.path.exists(address):
+        # left behind by a server that didn't shut down cleanly
+        os.remove(address)
+    broker = SessionBroker(max_bytes, loader)
+    
+    class ServerManager(SessionManager):
+        pass
+    
+    ServerManager.register('broker', callable=lambda: broker)
+    manager = ServerManager(address,
+                            authkey or get_authkey(address, create=True))
+    server = manager.get_server()
+    # clean up the shared blocks when killed, too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        broker.shutdown()
+
+
+def run():
+    """Entry point for console_scripts"""
+    parser = argparse.ArgumentParser(
+        description='Share loaded TH sessions between local processes.')
+    parser.add_argument('--address', default=None,
+                        help=f'socket to listen on (default: {default_address})')
+    parser.add_argument('--max-mb', type=float, default=8192,
+                        help='memory budget for shared sessions, in MB')
+    args = parser.parse_args()
+    serve(args.address, max_bytes=int(args.max_mb * 2**20))
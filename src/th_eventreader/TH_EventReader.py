@@ -6,11 +6,35 @@
 # This code will load TH events using cmlreaders and then find the missing path data using the log files.
 
 import os
+import sys
+import json
+import hashlib
+import time
+import glob
+import shutil
+import argparse
 import warnings
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 from cmlreaders import CMLReader, get_data_index
+from th_eventreader import LogExtractors
+from th_eventreader.LogExtractors import extract_log
+from th_eventreader.PathStore import save_paths, load_paths, offsets_checksum
+from th_eventreader.PathCodec import save_compressed_paths, load_compressed_paths
+from th_eventreader.SessionCache import SessionCache
+
+
+#------Sessions loaded in this process are kept in memory, up to
+#      TH_EVENTS_CACHE_MB megabytes. Use `session_cache.resize` to change.
+session_cache = SessionCache(
+    int(float(os.environ.get('TH_EVENTS_CACHE_MB', 1024)) * 2**20))
+
+#------How `save_events` stores pathInfo: 'npy' for memory-mapped
+#      arrays (see PathStore) or 'compressed' (see PathCodec)
+default_path_format = os.environ.get('TH_PATH_FORMAT', 'npy')
 
 
 def get_cmlevents(subj, montage=None, session=None, exp='TH1'):
@@ -38,14 +62,8 @@ def get_cmlevents(subj, montage=None, session=None, exp='TH1'):
     #------For some subjs the sess ID system changed over time,
     #      and we need to know the original sess ID for certain log
     #      files access
-    orig_sess_ID = this_specific_df['original_session'].iloc[0]
-    if type(orig_sess_ID) == str:
-        orig_sess_ID = np.float64(orig_sess_ID)
-        # I do it as float first in case of NaN
-        if orig_sess_ID == int(orig_sess_ID):
-            orig_sess_ID = int(orig_sess_ID)
-    if np.isnan(orig_sess_ID):
-        orig_sess_ID = session
+    orig_sess_ID = get_original_session_ID(
+        this_specific_df['original_session'].iloc[0], session)
     #------Use CMLReader to read the events structure
     reader = CMLReader(subj, exp, session=session, 
                        montage=montage, localization=loc)
@@ -59,18 +77,44 @@ def get_cmlevents(subj, montage=None, session=None, exp='TH1'):
     return events
 
 
-def get_baseline_mstimes(events):
-    """ Reads the .txt logfile to find the start and end mstimes
-        For all baseline periods. As defined in Miller et. al (2018),
-        baseline periods for TH are the time at the start of a trial
-        before nvavigation.
+def get_original_session_ID(orig_sess_ID, session):
+    """ Cleans up the 'original_session' field of the data index.
+        It is sometimes a str and sometimes NaN, in which case the
+        session was never renamed and `session` is used instead.
+    """
+    if type(orig_sess_ID) == str:
+        orig_sess_ID = np.float64(orig_sess_ID)
+        # I do it as float first in case of NaN
+        if orig_sess_ID == int(orig_sess_ID):
+            orig_sess_ID = int(orig_sess_ID)
+    if np.isnan(orig_sess_ID):
+        orig_sess_ID = session
+    return orig_sess_ID
+
+
+def get_behavioral_dir(subj_str, sess, exp):
+    """ Returns the directory holding the raw log files for a session.
+        
+        Args:
+            subj_str (str): Subject alias used in the log files.
+            sess (int): Original session ID.
+            exp (str)
+    """
+    return f'/data10/RAM/subjects/{subj_str}/behavioral/{exp}/session_{sess}/'
+
+
+def get_log_fields(events, extractors=None):
+    """ Reads each session's .txt logfile once and adds the per-trial
+        fields found by the log extractors (see LogExtractors) to the
+        events.
         
         Args:
             events (pd.DataFrame)
+            extractors (list): names of the registered extractors to
+                run. Defaults to all of them.
         
         Returns:
-            events (pd.DataFrame) with added fields:
-                ['baseline_start', 'baseline_end']
+            events (pd.DataFrame) with the extractors' fields added.
     """
     
     events = events.copy()
@@ -78,58 +122,46 @@ def get_baseline_mstimes(events):
     monts_and_sess = events[['subject_alias', 'original_session_ID']].drop_duplicates()
     exp = events['experiment'].iloc[0]
     
-    # get the baseline data
-    base_dfs = []
+    # get the per-trial data of each session
+    trial_dfs = []
     for (index, (subj_str, sess)) in monts_and_sess.iterrows():
-
-        log_file = (f'/data10/RAM/subjects/{subj_str}'
-                    f'/behavioral/{exp}/session_{sess}/{subj_str}Log.txt')
-
-        with open(log_file, 'r') as f:
-            log = f.read().split('\n')
-
-        baseline_starts = []
-        baseline_ends = []
-        current_start = np.nan
-
-        for line in log:
-            tokens = line.split('\t')
-            for i, token in enumerate(tokens):
-                # whichever of these start tokens appears
-                # last before the nav will be the baseline start period
-                # this is because its a little inconsistent about which appears
-                if (token == 'HOMEBASE_TRANSPORT_ENDED' 
-                    or token ==  'HOMEBASE_TRANSPORT_STARTED'
-                    or token == 'SHOWING_INSTRUCTIONS'
-                   ):
-                    current_start = int(tokens[0])
-                elif token == 'TRIAL_NAVIGATION_STARTED':
-                    baseline_ends.append(int(tokens[0]))
-                    baseline_starts.append(current_start)
-
-        base_dfs.append(pd.DataFrame(
-            {'baseline_start': baseline_starts, 'baseline_end': baseline_ends, 
-             'session': sess}))
-                
-
-    # put the baseline data into the events
-    events['baseline_start'] = np.nan
-    events['baseline_end'] = np.nan
-
-    for df in base_dfs:
-        sess_locs = events['original_session_ID']==df['session'].iloc[0]
-        for trial in events[sess_locs]['trial'].unique():
-            events.loc[sess_locs&(events['trial']==trial),
-                'baseline_start'] = df.loc[trial, 'baseline_start']
-            events.loc[sess_locs&(events['trial']==trial),
-                'baseline_end'] = df.loc[trial, 'baseline_end']
-
-    events['baseline_start'] = events['baseline_start'].astype(int)
-    events['baseline_end'] = events['baseline_end'].astype(int)
+        log_file = get_behavioral_dir(subj_str, sess, exp) + f'{subj_str}Log.txt'
+        trial_dfs.append((sess, extract_log(log_file, extractors)))
+    
+    # put the per-trial data into the events with one merge
+    keys = ['original_session_ID', 'trial']
+    trials = pd.concat([df.assign(original_session_ID=sess, trial=df.index)
+                        for sess, df in trial_dfs], ignore_index=True)
+    fields = events[keys].merge(trials, how='left', on=keys)
+    for col in fields.columns.drop(keys):
+        events[col] = fields[col].values
+    
+    names = list(LogExtractors.extractors) if extractors is None else extractors
+    dtypes = {}
+    for name in names:
+        dtypes.update(LogExtractors.extractors[name].dtypes)
+    for col, dtype in dtypes.items():
+        events[col] = events[col].astype(dtype)
     
     return events
 
 
+def get_baseline_mstimes(events):
+    """ Reads the .txt logfile to find the start and end mstimes
+        For all baseline periods. As defined in Miller et. al (2018),
+        baseline periods for TH are the time at the start of a trial
+        before nvavigation.
+        
+        Args:
+            events (pd.DataFrame)
+        
+        Returns:
+            events (pd.DataFrame) with added fields:
+                ['baseline_start', 'baseline_end']
+    """
+    return get_log_fields(events, ['baseline'])
+
+
 def read_path_log(events):
     """ Reads the .par log file of navigation data and organizes it to
         fit with the rest of the events DatFrame.
@@ -163,8 +195,7 @@ def read_path_log(events):
     #------Iterate sessions bc each has its own par file
     for (index, (subj_str, sess)) in monts_and_sess.iterrows():
         #------Read the par log file
-        par_file = (f'/data10/RAM/subjects/{subj_str}'
-                    f'/behavioral/{exp}/session_{sess}/playerPaths.par')
+        par_file = get_behavioral_dir(subj_str, sess, exp) + 'playerPaths.par'
         with open(par_file) as f:
             lines = f.read().split('\n')
         #------Init tracking vars
@@ -261,6 +292,19 @@ def get_nav_epochs(path):
     return move_start, move_end
 
 
+def get_data_dir():
+    """ Returns the directory that saved events data is kept in,
+        creating it if needed.
+    """
+    main_dir = __file__.split('src')[0] + 'data/'
+    if not os.path.exists(main_dir):
+        # if installed with pip
+        main_dir = __file__.split('TH_EventReader.py')[0] + 'data/'
+        # exist_ok since shards of a reload may get here at once
+        os.makedirs(main_dir, exist_ok=True)
+    return main_dir
+
+
 def get_savename(subj, montage, session, exp):
     """ Returns a relavent file path for saving events data.
         
@@ -275,35 +319,127 @@ def get_savename(subj, montage, session, exp):
     """
     if montage > 0:
         subj = f'{subj}_{montage}'
-    main_dir = __file__.split('src')[0] + 'data/'
-    if not os.path.exists(main_dir):
-        # if installed with pip
-        main_dir = __file__.split('TH_EventReader.py')[0] + 'data/'
-        if not os.path.exists(main_dir):
-            os.mkdir(main_dir)
-    exp_dir = main_dir + exp + '/'
-    if not os.path.exists(exp_dir):
-        os.mkdir(exp_dir) 
-    subj_dir = exp_dir + subj + '/'
-    if not os.path.exists(subj_dir):
-        os.mkdir(subj_dir)
+    subj_dir = get_data_dir() + exp + '/' + subj + '/'
+    os.makedirs(subj_dir, exist_ok=True)
     return subj_dir + f'session_{session}.pkl'
 
 
-def save_events(events, subj, montage, session, exp):
-    """ Saves the events in the relevant file path.
+def get_paths_dirname(subj, montage, session, exp):
+    """ Returns the directory that the path store for a session is
+        saved in, next to its `get_savename` file.
     """
+    return get_savename(subj, montage, session, exp)[:-len('.pkl')] + '_paths/'
+
+
+def get_compressed_paths_name(subj, montage, session, exp):
+    """ Returns the file that the compressed paths for a session are
+        saved in, next to its `get_savename` file.
+    """
+    return get_savename(subj, montage, session, exp)[:-len('.pkl')] + '_paths.thp'
+
+
+def save_events(events, subj, montage, session, exp, path_format=None):
+    """ Saves the events in the relevant file path. The 'pathInfo' is
+        saved separately, as a path store (see PathStore) if path_format
+        is 'npy' or encoded (see PathCodec) if it is 'compressed'.
+        Defaults to `default_path_format`. The pickle records which
+        paths it was saved with, and is written last, so `load_events`
+        can tell if the two don't go together.
+    """
+    if path_format is None:
+        path_format = default_path_format
     fname = get_savename(subj, montage, session, exp)
-    events.to_pickle(fname)
+    paths_dir = get_paths_dirname(subj, montage, session, exp)
+    paths_fname = get_compressed_paths_name(subj, montage, session, exp)
+    if 'pathInfo' in events:
+        if path_format == 'npy':
+            offsets = save_paths(events['pathInfo'], paths_dir)
+            stale = [paths_fname]
+        elif path_format == 'compressed':
+            offsets = save_compressed_paths(events['pathInfo'], paths_fname)
+            stale = [paths_dir]
+        else:
+            raise ValueError(f"path_format must be 'npy' or 'compressed', "
+                             f"not {path_format!r}")
+        events = events.drop(columns='pathInfo')
+        paths = {'format': path_format, 'n_samples': int(offsets[-1]),
+                 'checksum': offsets_checksum(offsets)}
+    else:
+        # recorded too, so loading doesn't go looking for paths
+        paths = None
+        stale = [paths_dir, paths_fname]
+    events = events.copy(deep=False) # leave the caller's attrs alone
+    events.attrs = {**events.attrs, 'paths': paths}
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    events.to_pickle(tmp_fname)
+    os.replace(tmp_fname, fname)
+    for stale_fname in stale:
+        # don't leave old paths around that don't go with these events
+        if os.path.isdir(stale_fname):
+            shutil.rmtree(stale_fname)
+        elif os.path.exists(stale_fname):
+            os.remove(stale_fname)
+    session_cache.invalidate((subj, montage, session, exp))
+
+
+def _read_events(subj, montage, session, exp, mmap=True):
+    """ Reads the saved events and their paths for `load_events`.
+        
+        Raises:
+            ValueError if the paths on disk aren't the ones the events
+            were saved with.
+    """
+    events = pd.read_pickle(get_savename(subj, montage, session, exp))
+    if 'pathInfo' in events:
+        # events saved before path stores keep pathInfo in the pickle
+        return events
+    # events saved before the format was recorded have no 'paths'
+    saved = events.attrs.pop('paths', {})
+    if saved is None:
+        # saved without paths
+        return events
+    paths_fname = get_compressed_paths_name(subj, montage, session, exp)
+    if saved.get('format', 'compressed' if os.path.exists(paths_fname)
+                 else 'npy') == 'compressed':
+        store = load_compressed_paths(paths_fname)
+    else:
+        store = load_paths(get_paths_dirname(subj, montage, session, exp),
+                           mmap=mmap)
+    if (len(store) != len(events)
+        or ('checksum' in saved and store.checksum() != saved['checksum'])
+        or ('n_samples' in saved and store.offsets[-1] != saved['n_samples'])):
+        raise ValueError(f'The saved paths of {subj} montage {montage} '
+                         f'session {session} {exp} do not match its events')
+    events['pathInfo'] = store.paths()
+    return events
     
 
-def load_events(subj, montage, session, exp):
-    """Loads the events from the relevant file path."""
-    return pd.read_pickle(get_savename(subj, montage, session, exp))
+def load_events(subj, montage, session, exp, cache=True, mmap=True):
+    """ Loads the events from the relevant file path.
+        If cache, the events are kept in and served from `session_cache`.
+        If mmap, the 'pathInfo' of each event is a lazy, read-only
+        EventPath that is only read from disk when used. Compressed
+        paths are always read into memory.
+    """
+    key = (subj, montage, session, exp)
+    if cache:
+        events = session_cache.get(key)
+        if events is not None:
+            return events
+    try:
+        events = _read_events(subj, montage, session, exp, mmap)
+    except (FileNotFoundError, ValueError):
+        # the session may have been caught halfway through being
+        # saved by another process, so give it a moment and look again
+        time.sleep(0.5)
+        events = _read_events(subj, montage, session, exp, mmap)
+    if cache:
+        session_cache.put(key, events)
+    return events
 
 
 def get_events(subj, montage, session, exp,
-               recalc=False, save=True):
+               recalc=False, save=True, cache=True):
     """ Returns the reformatted events df with 'pathInfo'.
         
         Args:
@@ -314,23 +450,32 @@ def get_events(subj, montage, session, exp,
             recalc (bool): If False, attempts to load presaved data.
             save (bool): If True, will save the events in a filepath
                 determined by `get_savename`.
+            cache (bool): If True, uses and fills the in-memory
+                `session_cache`.
         
         Returns:
             pd.DataFrame containing events
     """
     
     if not recalc:
+        if cache:
+            events = session_cache.get((subj, montage, session, exp))
+            if events is not None:
+                return events
         save_fname = get_savename(subj, montage, session, exp)
         if os.path.exists(save_fname):
             try:
-                return load_events(subj, montage, session, exp)
+                events = load_events(subj, montage, session, exp, cache=False)
+                if cache:
+                    session_cache.put((subj, montage, session, exp), events)
+                return events
             except:
                 pass
     
     events = get_cmlevents(subj, montage, session, exp)
     
-    # get baselines
-    events = get_baseline_mstimes(events)
+    # get baselines and any other fields from the log
+    events = get_log_fields(events)
     
     # get path
     events = read_path_log(events)
@@ -347,6 +492,8 @@ def get_events(subj, montage, session, exp,
 
     if save:
         save_events(events, subj, montage, session, exp)
+    if cache:
+        session_cache.put((subj, montage, session, exp), events)
         
     return events
 
@@ -377,17 +524,461 @@ def exp_df(exp='TH1'):
     return df[['subj', 'montage', 'session', 'exp']]
 
 
-def reload_all(exp):
+def _load_session(key, columns, kwargs):
+    """ Loads one session for `iter_events`. At module level so it can
+        be sent to worker processes.
+    """
+    events = get_events(*key, **kwargs)
+    if columns is not None:
+        events = events[list(columns)]
+    return events
+
+
+def iter_events(exp='TH1', columns=None, prefetch=2, processes=False,
+                errors='skip', failures=None, **kwargs):
+    """ Yields the events of every session in exp one at a time, while
+        the next sessions are loaded in the background. At most
+        prefetch sessions are loaded ahead of the one being worked on,
+        so the whole experiment is never in memory at once. Example:
+        
+            for (subj, montage, session, exp), events in iter_events('TH1'):
+                ...
+        
+        Args:
+            exp (str)
+            columns (list): only keep these columns of the events.
+            prefetch (int): number of sessions to load ahead.
+                0 loads each session when it is needed.
+            processes (bool): load in worker processes instead of
+                threads, for when parsing rather than I/O is the
+                bottleneck.
+            errors (str): 'skip' to warn about sessions that fail to
+                load and carry on, or 'raise'.
+            failures (list): if given, (key, exception) pairs of the
+                sessions that failed are appended to it.
+            **kwargs: passed to `get_events`. The in-memory cache is
+                off by default since each session is only seen once.
+        
+        Yields:
+            ((subj, montage, session, exp), pd.DataFrame)
+        
+        Raises:
+            ValueError if errors isn't 'skip' or 'raise'.
+    """
+    if errors not in ('skip', 'raise'):
+        raise ValueError(f"errors must be 'skip' or 'raise', not {errors!r}")
+    return _iter_events(exp, columns, prefetch, processes, errors,
+                        failures, kwargs)
+
+
+def _iter_events(exp, columns, prefetch, processes, errors, failures, kwargs):
+    """The generator behind `iter_events`."""
+    kwargs.setdefault('cache', False)
+    keys = iter([tuple(row) for i, row in exp_df(exp).iterrows()])
+    
+    if prefetch < 1:
+        executor = None
+    elif processes:
+        executor = ProcessPoolExecutor(max_workers=prefetch)
+    else:
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+    pending = deque()
+    def submit_next():
+        """Starts loading the next session, if there is one."""
+        key = next(keys, None)
+        if key is not None:
+            if executor is None:
+                pending.append((key, None))
+            else:
+                pending.append((key, executor.submit(_load_session, key,
+                                                     columns, kwargs)))
+    
+    try:
+        for i in range(max(prefetch, 1)):
+            submit_next()
+        while pending:
+            key, future = pending.popleft()
+            # keep prefetch sessions loading while this one is used
+            submit_next()
+            try:
+                if future is None:
+                    events = _load_session(key, columns, kwargs)
+                else:
+                    events = future.result()
+            except Exception as e:
+                if errors == 'raise':
+                    raise
+                warnings.warn(f'Skipping {key}: {type(e).__name__}: {e}')
+                if failures is not None:
+                    failures.append((key, e))
+                continue
+            yield key, events
+            del events
+    finally:
+        if executor is not None:
+            # don't load sessions nobody will see, e.g. if the loop
+            # over the events stopped early
+            for key, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+def reduce_events(func, initial, exp='TH1', **kwargs):
+    """ Folds func over the events of every session in exp, streaming
+        them with `iter_events`. Example, counting events by type:
+        
+            counts = reduce_events(
+                lambda counts, key, events:
+                    counts.add(events['type'].value_counts(), fill_value=0),
+                pd.Series(dtype=float), 'TH1', columns=['type'])
+        
+        Args:
+            func: called as func(acc, key, events) for each session,
+                returning the new acc.
+            initial: the starting acc.
+            exp (str)
+            **kwargs: passed to `iter_events`.
+        
+        Returns:
+            the final acc
+    """
+    acc = initial
+    for key, events in iter_events(exp, **kwargs):
+        acc = func(acc, key, events)
+    return acc
+
+
+def session_sizes(exp='TH1'):
+    """ Estimates how much work it is to reload each session in exp,
+        using the size in bytes of its raw Log.txt and playerPaths.par.
+        The raw logs don't change while events are being rebuilt, so
+        every shard of a reload computes the same sizes.
+        
+        Returns:
+            pd.Series of sizes with the same index as `exp_df(exp)`
+    """
+    df = get_data_index("r1")
+    df = df[df['experiment'] == exp]
+    sizes = []
+    for i, row in df.iterrows():
+        subj_str = row['subject_alias']
+        sess = get_original_session_ID(row['original_session'], row['session'])
+        log_dir = get_behavioral_dir(subj_str, sess, exp)
+        size = 0
+        for fname in (f'{subj_str}Log.txt', 'playerPaths.par'):
+            try:
+                size += os.path.getsize(log_dir + fname)
+            except OSError:
+                pass
+        # missing logs still cost a failed attempt
+        sizes.append(max(size, 1))
+    return pd.Series(sizes, index=df.index)
+
+
+def shard_sessions(df, sizes, shard, n_shards):
+    """ Splits the sessions in df into n_shards size-balanced groups
+        and returns the group for this shard. Sessions are handed out
+        biggest first to whichever shard has the least work so far,
+        breaking ties by session key and shard number, so the split is
+        the same no matter which shard computes it.
+        
+        Args:
+            df (pd.DataFrame): from `exp_df`.
+            sizes (pd.Series): work estimate per row of df,
+                see `session_sizes`.
+            shard (int): 0-based shard number.
+            n_shards (int)
+        
+        Returns:
+            pd.DataFrame with the rows of df assigned to this shard.
+    """
+    if not 0 <= shard < n_shards:
+        raise ValueError(f'shard {shard} is out of range for {n_shards} shards')
+    order = sorted(df.index,
+                   key=lambda i: (-sizes[i], str(df.loc[i, 'subj']),
+                                  int(df.loc[i, 'montage']),
+                                  int(df.loc[i, 'session'])))
+    loads = np.zeros(n_shards)
+    assigned = []
+    for i in order:
+        this_shard = int(np.argmin(loads))
+        loads[this_shard] += sizes[i]
+        if this_shard == shard:
+            assigned.append(i)
+    return df[df.index.isin(assigned)]
+
+
+def parse_shard(spec=None):
+    """ Figures out which shard this process should reload.
+        
+        Args:
+            spec (str): 'i/N' for shard i (0-based) of N. If None, the
+                TH_SHARD/TH_NSHARDS environment variables are used, then
+                a SLURM job array's task ID and count. Without any of
+                these there is a single shard.
+        
+        Returns:
+            (shard, n_shards)
+    """
+    env = os.environ
+    if spec is None:
+        if 'TH_SHARD' in env:
+            spec = f"{env['TH_SHARD']}/{env.get('TH_NSHARDS', 1)}"
+        elif 'SLURM_ARRAY_TASK_ID' in env and 'SLURM_ARRAY_TASK_COUNT' in env:
+            task_min = int(env.get('SLURM_ARRAY_TASK_MIN', 0))
+            spec = (f"{int(env['SLURM_ARRAY_TASK_ID']) - task_min}"
+                    f"/{env['SLURM_ARRAY_TASK_COUNT']}")
+        else:
+            return 0, 1
+    try:
+        shard, n_shards = (int(i) for i in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"shard must look like 'i/N', got {spec!r}")
+    if not 0 <= shard < n_shards:
+        raise ValueError(f'shard {shard} is out of range for {n_shards} shards')
+    return shard, n_shards
+
+
+def get_run_id(run_id=None, n_shards=1):
+    """ Figures out the ID of the reload run this process is part of,
+        which keeps its manifests apart from those of earlier runs.
+        
+        Args:
+            run_id (str): If None, the TH_RUN_ID environment variable is
+                used, then a SLURM job array's job ID. A single shard
+                run without any of these gets a new ID from the time.
+            n_shards (int)
+        
+        Returns:
+            str
+    """
+    env = os.environ
+    if run_id is None:
+        run_id = env.get('TH_RUN_ID', env.get('SLURM_ARRAY_JOB_ID'))
+    if run_id is None:
+        if n_shards > 1:
+            raise ValueError('Sharded reloads need a run ID shared by all '
+                             'the shards (--run-id or TH_RUN_ID)')
+        run_id = time.strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+    run_id = str(run_id)
+    if not run_id or '/' in run_id:
+        raise ValueError(f'Bad run ID {run_id!r}')
+    return run_id
+
+
+def get_manifest_dir(exp, run_id=None):
+    """ Returns the directory that reload manifests for exp are saved
+        in, or those of one run if run_id is given.
+    """
+    manifest_dir = get_data_dir() + f'manifests/{exp}/'
+    if run_id is not None:
+        manifest_dir += f'{run_id}/'
+    os.makedirs(manifest_dir, exist_ok=True)
+    return manifest_dir
+
+
+def _write_json(obj, fname):
+    """ Writes obj as json to fname without ever leaving a half
+        written file behind for a merge to trip over.
+    """
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp_fname, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp_fname, fname)
+
+
+def _session_key(row):
+    """Returns (subj, montage, session, exp) of an `exp_df` row as plain types."""
+    return (str(row['subj']), int(row['montage']), int(row['session']),
+            str(row['exp']))
+
+
+def plan_hash(df, sizes=None):
+    """ Hashes the sessions (and their sizes) that a reload was split up
+        from, so `merge_manifests` can check that every shard agreed.
+    """
+    plan = sorted([*_session_key(row), None if sizes is None else int(sizes[i])]
+                  for i, row in df.iterrows())
+    return hashlib.sha1(json.dumps(plan).encode()).hexdigest()
+
+
+def reload_all(exp, shard=0, n_shards=1, run_id=None):
     """ Reloads all events from a particular experiment. Helpful if the events have
         been previously loaded and saved with an older version of TH_EventReader.
+        
+        The sessions can be split up between n_shards independent jobs
+        (see `shard_sessions`), each of which saves a manifest of what
+        it did. Use `merge_manifests` once they are all done.
+        
+        Args:
+            exp (str)
+            shard (int): 0-based shard number to reload.
+            n_shards (int)
+            run_id (str): ID shared by all the shards of this run,
+                see `get_run_id`.
+        
+        Returns:
+            list of dicts, one per session, with the status of its reload.
     """
     
+    run_id = get_run_id(run_id, n_shards)
     df = exp_df(exp)
+    if n_shards > 1:
+        sizes = session_sizes(exp)
+        plan = plan_hash(df, sizes)
+        df = shard_sessions(df, sizes, shard, n_shards)
+    else:
+        plan = plan_hash(df)
     
+    sessions = []
+    shard_start = time.time()
     for i, row in df.iterrows():
         print([key for key in row], end=' -> ')
+        start = time.time()
+        record = dict(zip(['subj', 'montage', 'session', 'exp'],
+                          _session_key(row)))
         try:
-            events = get_events(**row, recalc=True)
+            events = get_events(**row, recalc=True, cache=False)
             print('Success!')
-        except FileNotFoundError as e:
-            print(e)
\ No newline at end of file
+            record['status'] = 'success'
+            record['n_events'] = len(events)
+        except Exception as e:
+            print(e)
+            record['status'] = 'failed'
+            record['error'] = f'{type(e).__name__}: {e}'
+        record['seconds'] = time.time() - start
+        sessions.append(record)
+    
+    _write_json({'exp': exp, 'run_id': run_id, 'shard': shard,
+                 'n_shards': n_shards, 'plan': plan, 'host': os.uname()[1],
+                 'seconds': time.time() - shard_start, 'sessions': sessions},
+                get_manifest_dir(exp, run_id)
+                + f'shard_{shard}_of_{n_shards}.json')
+    return sessions
+
+
+def merge_manifests(exp, run_id=None):
+    """ Collects the per-shard manifests of one run of `reload_all`
+        into a report for the experiment, which is also saved as
+        report.json next to them.
+        
+        Args:
+            exp (str)
+            run_id (str): the run to merge. Defaults to the run with
+                the most recently written manifest.
+        
+        Returns:
+            dict with the sessions that succeeded and failed, timings,
+            and anything that makes the run incomplete: shards that have
+            no manifest yet, sessions of `exp_df(exp)` that no shard
+            covered or that more than one did, and shards that split
+            the sessions up differently ('plans_agree'). 'complete' is
+            True if there is none of that.
+    """
+    if run_id is None:
+        fnames = glob.glob(get_manifest_dir(exp) + '*/shard_*_of_*.json')
+        if not fnames:
+            raise FileNotFoundError(f'No reload manifests for {exp}')
+        run_id = os.path.basename(os.path.dirname(
+            max(fnames, key=os.path.getmtime)))
+    manifest_dir = get_manifest_dir(exp, run_id)
+    manifests = []
+    for fname in glob.glob(manifest_dir + 'shard_*_of_*.json'):
+        with open(fname) as f:
+            manifests.append(json.load(f))
+    manifests = [m for m in manifests if m.get('run_id') == run_id]
+    if not manifests:
+        raise FileNotFoundError(f'No reload manifests in {manifest_dir}')
+    n_shards_seen = {m['n_shards'] for m in manifests}
+    if len(n_shards_seen) > 1:
+        raise ValueError(f'Run {run_id} has manifests for different shard '
+                         f'counts: {sorted(n_shards_seen)}')
+    n_shards = n_shards_seen.pop()
+    manifests = sorted(manifests, key=lambda m: m['shard'])
+    
+    sessions = [sess for m in manifests for sess in m['sessions']]
+    failures = [sess for sess in sessions if sess['status'] != 'success']
+    #------Check the shards between them did each session once
+    covered = Counter((sess['subj'], sess['montage'], sess['session'],
+                       sess['exp']) for sess in sessions)
+    expected = {_session_key(row) for i, row in exp_df(exp).iterrows()}
+    missing_shards = sorted(set(range(n_shards))
+                            - {m['shard'] for m in manifests})
+    uncovered = sorted(expected - set(covered))
+    duplicated = sorted(key for key, count in covered.items() if count > 1)
+    unexpected = sorted(set(covered) - expected)
+    plans_agree = len({m.get('plan') for m in manifests}) == 1
+    report = {
+        'exp': exp,
+        'run_id': run_id,
+        'n_shards': n_shards,
+        'complete': not (missing_shards or uncovered or duplicated
+                         or unexpected) and plans_agree,
+        'missing_shards': missing_shards,
+        'uncovered_sessions': uncovered,
+        'duplicated_sessions': duplicated,
+        'unexpected_sessions': unexpected,
+        'plans_agree': plans_agree,
+        'n_expected': len(expected),
+        'n_sessions': len(sessions),
+        'n_success': len(sessions) - len(failures),
+        'n_failed': len(failures),
+        'session_seconds': sum(sess['seconds'] for sess in sessions),
+        'shard_seconds': {m['shard']: m['seconds'] for m in manifests},
+        'failures': failures,
+        'sessions': sessions,
+    }
+    _write_json(report, manifest_dir + 'report.json')
+    return report
+
+
+def main(args=None):
+    """ Command line interface for reloading events, e.g.
+        
+            python create_events.py TH1 TH3 THR --shard 3/16 --run-id rebuild1
+            python create_events.py TH1 TH3 THR --merge --run-id rebuild1
+        
+        Without --shard and --run-id, they are taken from the environment
+        (see `parse_shard` and `get_run_id`), so the same command works
+        as a SLURM array job.
+    """
+    parser = argparse.ArgumentParser(
+        description='Reload and save TH events with their pathInfo.')
+    parser.add_argument('exps', nargs='*', default=['TH1'],
+                        help='experiments to reload (default: TH1)')
+    parser.add_argument('--shard', default=None,
+                        help="'i/N' to reload only shard i (0-based) of N")
+    parser.add_argument('--run-id', default=None,
+                        help='ID shared by all the shards of a run; '
+                             'merging defaults to the latest run')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the shard manifests into a report '
+                             'instead of reloading')
+    args = parser.parse_args(args)
+    
+    for exp in args.exps:
+        if args.merge:
+            report = merge_manifests(exp, args.run_id)
+            print(f"{exp} run {report['run_id']}: {report['n_success']}/"
+                  f"{report['n_expected']} sessions succeeded over "
+                  f"{report['n_shards']} shards"
+                  + ('' if report['complete'] else ' (INCOMPLETE)'))
+            if report['missing_shards']:
+                print(f"  missing shards: {report['missing_shards']}")
+            if not report['plans_agree']:
+                print('  the shards did not agree on how to split the sessions')
+            for problem in ['uncovered', 'duplicated', 'unexpected']:
+                if report[f'{problem}_sessions']:
+                    print(f"  {problem} sessions: "
+                          f"{report[f'{problem}_sessions']}")
+            for sess in report['failures']:
+                print(f"  {sess['subj']} montage {sess['montage']} "
+                      f"session {sess['session']}: {sess.get('error')}")
+        else:
+            shard, n_shards = parse_shard(args.shard)
+            reload_all(exp, shard, n_shards, args.run_id)
+
+
+def run():
+    """Entry point for console_scripts"""
+    main(sys.argv[1:])
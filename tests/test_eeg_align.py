@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from th_eventreader import EEGAlign
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+@pytest.fixture
+def file_info():
+    return pd.DataFrame({'sample_rate': [500.0, 1000.0, np.nan],
+                         'n_samples': [1000.0, 5000.0, np.nan]},
+                        index=['a', 'b', 'missing'])
+
+
+def make_events():
+    return pd.DataFrame({
+        'eegfile': ['a', 'a', 'a', 'b', 'missing', 'a'],
+        'eegoffset': [100, 900, 10, 1000, 5, -1],
+        'mstime': [1000] * 6,
+        'nav_start': [1000, 1000, 900, 1000, 1000, 1000],
+        'nav_end': [1500, 2000, 1100, 1500, 1100, 1100],
+        'baseline_start': [900, np.nan, 900, 500, 900, 900],
+        'baseline_end': [1000, np.nan, 1000, 1000, 1000, 1000],
+    }, index=[10, 11, 12, 13, 14, 15])
+
+
+def test_valid_eeg_events(file_info):
+    valid = EEGAlign.valid_eeg_events(make_events(), file_info)
+    assert list(valid) == [True, True, True, True, False, False]
+
+
+def test_align_windows(file_info):
+    aligned = EEGAlign.align_windows(make_events(), buffer_ms=10,
+                                     file_info=file_info)
+    assert list(aligned.index) == [10, 11, 12, 13, 14, 15]
+    # 500Hz: 2 samples per ms step of 1000/500
+    assert aligned.loc[10, 'nav_start_sample'] == 100 - 5
+    assert aligned.loc[10, 'nav_stop_sample'] == 100 + 255
+    # per file sample rates
+    assert aligned.loc[13, 'nav_start_sample'] == 1000 - 10
+    assert aligned.loc[13, 'nav_stop_sample'] == 1000 + 510
+    assert aligned.loc[13, 'baseline_start_sample'] == 1000 - 510
+    # runs off the end, clipped and flagged
+    assert aligned.loc[11, 'nav_crosses_file']
+    assert not aligned.loc[11, 'nav_valid']
+    assert aligned.loc[11, 'nav_stop_sample'] == 1000
+    # runs off the start
+    assert aligned.loc[12, 'nav_crosses_file']
+    assert aligned.loc[12, 'nav_start_sample'] == 0
+    # no window times, unknown file, bad eegoffset
+    assert not aligned.loc[11, 'baseline_valid']
+    assert not aligned.loc[14, 'nav_valid']
+    assert not aligned.loc[15, 'nav_valid']
+    assert list(aligned['nav_valid']) == [True, False, False, True, False, False]
+
+
+def test_batch_reads(file_info):
+    events = make_events()
+    aligned = EEGAlign.align_windows(events, file_info=file_info)
+    reads = EEGAlign.batch_reads(events, aligned, 'nav')
+    assert sorted(reads) == ['a', 'b']
+    locs, starts, stops = reads['a']
+    assert list(locs) == [10]
+    assert list(starts) == [100] and list(stops) == [350]
+
+
+def test_get_file_info_uses_subject_alias(tmp_path, monkeypatch):
+    monkeypatch.setattr(EEGAlign, 'sources_path',
+                        str(tmp_path) + '/{subj}_{exp}_{session}.json')
+    with open(tmp_path / 'R1001P_1_TH1_0.json', 'w') as f:
+        json.dump({'R1001P_1_TH1_0_eeg': {'sample_rate': 500,
+                                          'n_samples': 2000}}, f)
+    events = pd.DataFrame({'eegfile': 'R1001P_1_TH1_0_eeg',
+                           'subject': 'R1001P', 'subject_alias': 'R1001P_1',
+                           'experiment': 'TH1', 'session': [0, 0]})
+    info = EEGAlign.get_file_info(events)
+    assert info.loc['R1001P_1_TH1_0_eeg', 'sample_rate'] == 500
+    assert info.loc['R1001P_1_TH1_0_eeg', 'n_samples'] == 2000
+
+
+def test_get_file_info_missing_warns():
+    # like the matlab events: a session but no experiment column
+    events = pd.DataFrame({'eegfile': 'nowhere', 'session': [0]})
+    with pytest.warns(UserWarning):
+        info = EEGAlign.get_file_info(events)
+    assert info.isna().all().all()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+import multiprocessing
+
+import pytest
+import numpy as np
+import pandas as pd
+
+pytest.importorskip('cmlreaders')
+pytest.importorskip('matplotlib')
+from th_eventreader import TH_EventReader as ereader
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+pytestmark = pytest.mark.filterwarnings('ignore:Skipping')
+
+
+def fake_get_events(subj, montage, session, exp, cache=True):
+    if subj == 'R1002P':
+        raise FileNotFoundError(subj)
+    return pd.DataFrame({'mstime': np.arange(5) + session,
+                         'type': ['CHEST'] * 5,
+                         'pid': [os.getpid()] * 5})
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    df = pd.DataFrame({'subject': ['R1001P'] * 4 + ['R1002P', 'R1003P'],
+                       'montage': 0, 'session': [0, 1, 2, 3, 0, 0],
+                       'experiment': 'TH1'})
+    monkeypatch.setattr(ereader, 'exp_df', lambda exp='TH1': df)
+    loaded = []
+    lock = threading.Lock()
+    def get_events(*key, **kwargs):
+        with lock:
+            loaded.append(key)
+        return fake_get_events(*key, **kwargs)
+    monkeypatch.setattr(ereader, 'get_events', get_events)
+    return loaded
+
+
+def test_skip_and_raise(loaded):
+    failures = []
+    with pytest.warns(UserWarning, match='R1002P'):
+        keys = [key for key, events in ereader.iter_events(failures=failures)]
+    assert [key[0] for key in keys] == ['R1001P'] * 4 + ['R1003P']
+    assert [key for key, e in failures] == [('R1002P', 0, 0, 'TH1')]
+    assert isinstance(failures[0][1], FileNotFoundError)
+    with pytest.raises(FileNotFoundError):
+        list(ereader.iter_events(errors='raise'))
+    with pytest.raises(ValueError):
+        ereader.iter_events(errors='ignore')
+
+
+@pytest.mark.parametrize('prefetch', [0, 1, 2])
+def test_prefetch_bound(loaded, prefetch):
+    for key, events in ereader.iter_events(prefetch=prefetch):
+        # the ones done with, this one and at most prefetch more
+        assert len(loaded) <= loaded.index(key) + 1 + prefetch
+        assert (events['mstime'] == np.arange(5) + key[2]).all()
+
+
+def test_early_close(loaded):
+    sessions = ereader.iter_events(prefetch=2)
+    next(sessions)
+    sessions.close()
+    n_loaded = len(loaded)
+    assert n_loaded <= 3
+    time.sleep(0.1)
+    assert len(loaded) == n_loaded # nothing left running
+
+
+def test_columns_and_reduce(loaded):
+    for key, events in ereader.iter_events(columns=['type']):
+        assert list(events.columns) == ['type']
+    counts = ereader.reduce_events(
+        lambda counts, key, events: counts + len(events), 0,
+        columns=['type'], errors='skip')
+    assert counts == 25
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='workers need to inherit the patched get_events')
+def test_processes(loaded):
+    pids = set()
+    for key, events in ereader.iter_events(processes=True, failures=[]):
+        pids.update(events['pid'])
+    assert os.getpid() not in pids
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from th_eventreader import LogExtractors
+from th_eventreader.LogExtractors import LogExtractor, extract_log
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+LOG = '\n'.join([
+    '100\t0\tSHOWING_INSTRUCTIONS',
+    '150\t0\tHOMEBASE_TRANSPORT_STARTED',
+    '160\t0\tRECALL_STARTED',
+    '200\t0\tTRIAL_NAVIGATION_STARTED',
+    '250\t0\tsomething else',
+    '300\t0\tHOMEBASE_TRANSPORT_ENDED',
+    '400\t0\tTRIAL_NAVIGATION_STARTED',
+    '420\t0\tRECALL_STARTED',
+    '500\t0\tHOMEBASE_TRANSPORT_STARTED',
+    '550\t0\tTRIAL_NAVIGATION_STARTED',
+    '',
+])
+
+
+def old_baselines(log_file):
+    """The baseline loop that get_baseline_mstimes used to run."""
+    with open(log_file, 'r') as f:
+        log = f.read().split('\n')
+    baseline_starts = []
+    baseline_ends = []
+    current_start = np.nan
+    for line in log:
+        tokens = line.split('\t')
+        for i, token in enumerate(tokens):
+            if (token == 'HOMEBASE_TRANSPORT_ENDED'
+                or token == 'HOMEBASE_TRANSPORT_STARTED'
+                or token == 'SHOWING_INSTRUCTIONS'):
+                current_start = int(tokens[0])
+            elif token == 'TRIAL_NAVIGATION_STARTED':
+                baseline_ends.append(int(tokens[0]))
+                baseline_starts.append(current_start)
+    return pd.DataFrame({'baseline_start': baseline_starts,
+                         'baseline_end': baseline_ends})
+
+
+class RecallExtractor(LogExtractor):
+    name = 'test_recall'
+    tokens = ('RECALL_STARTED',)
+    
+    def __init__(self):
+        self.starts = []
+    
+    def feed(self, mstime, token, tokens):
+        self.starts.append(mstime)
+    
+    def table(self):
+        return pd.DataFrame({'recall_start': self.starts})
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    (tmp_path / 'R1001PLog.txt').write_text(LOG)
+    return f'{tmp_path}/'
+
+
+def test_baseline_extractor_matches_old_loop(log_dir):
+    table = extract_log(log_dir + 'R1001PLog.txt', ['baseline'])
+    pd.testing.assert_frame_equal(table, old_baselines(log_dir + 'R1001PLog.txt'),
+                                  check_dtype=False)
+
+
+def test_extractors_share_one_pass(log_dir, monkeypatch):
+    monkeypatch.setitem(LogExtractors.extractors, 'test_recall', RecallExtractor)
+    table = extract_log(log_dir + 'R1001PLog.txt', ['baseline', 'test_recall'])
+    assert list(table['recall_start'].dropna()) == [160, 420]
+    assert list(table['baseline_end']) == [200, 400, 550]
+
+
+def test_get_log_fields(log_dir, monkeypatch):
+    pytest.importorskip('cmlreaders')
+    pytest.importorskip('matplotlib')
+    from th_eventreader import TH_EventReader as ereader
+    monkeypatch.setattr(ereader, 'get_behavioral_dir', lambda *args: log_dir)
+    events = pd.DataFrame({'subject_alias': 'R1001P', 'original_session_ID': 0,
+                           'experiment': 'TH1', 'trial': [2, 0, 1, 0]},
+                          index=[10, 11, 12, 13])
+    events = ereader.get_baseline_mstimes(events)
+    old = old_baselines(log_dir + 'R1001PLog.txt')
+    for i, event in events.iterrows():
+        assert event['baseline_start'] == old.loc[event['trial'], 'baseline_start']
+        assert event['baseline_end'] == old.loc[event['trial'], 'baseline_end']
+    assert list(events.index) == [10, 11, 12, 13]
+    assert events['baseline_start'].dtype == int
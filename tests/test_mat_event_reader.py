@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('scipy')
+pytest.importorskip('matplotlib')
+from th_eventreader import MatEventReader
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+def test_validity_per_event(monkeypatch):
+    mat_events = pd.DataFrame({
+        'mstime': np.arange(6.0),
+        'eegfile': ['a', 'a', [], 'missing', 'missing', 'a'],
+        'eegoffset': [10, 2000, 10, 10, 10, 10],
+        'pathInfo': [None] * 6,
+    })
+    file_info = pd.DataFrame({'sample_rate': [500.0, np.nan],
+                              'n_samples': [1000.0, np.nan]},
+                             index=['a', 'missing'])
+    monkeypatch.setattr(MatEventReader, 'load_mat_events',
+                        lambda *args: mat_events.copy())
+    monkeypatch.setattr(MatEventReader, 'get_file_info',
+                        lambda events: file_info)
+    monkeypatch.setattr(MatEventReader, 'mat_pathData_to_list',
+                        lambda events: None)
+    # 'a' is checked against its file; 'missing' falls back on the cutoff,
+    # which keeps the first three events that have an eegfile
+    monkeypatch.setattr(MatEventReader, 'last_valid_event', lambda subj: 4)
+    events = MatEventReader.get_events_from_mat('R1000T', 0, 'TH1')
+    assert list(events['mstime']) == [0, 3, 5]
+    # without a cutoff, events with unknown files are kept
+    monkeypatch.setattr(MatEventReader, 'last_valid_event', lambda subj: None)
+    events = MatEventReader.get_events_from_mat('R1000T', 0, 'TH1')
+    assert list(events['mstime']) == [0, 3, 4, 5]
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from th_eventreader import PathCodec
+from th_eventreader.PathStore import pack_paths
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+def make_paths(lengths=(50, 0, 20), seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    mstime = 1_500_000_000_000
+    for n in lengths:
+        times = mstime + np.cumsum(rng.integers(15, 19, n))
+        paths.append([{'mstime': int(t), 'x': float(x), 'y': float(y),
+                       'heading': float(h)}
+                      for t, x, y, h in zip(times, rng.normal(0, 30, n),
+                                            rng.normal(0, 30, n),
+                                            rng.uniform(0, 360, n))])
+        mstime += 100_000
+    return paths
+
+
+def test_varint_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 2**32, 2**64 - 1], dtype=np.uint64)
+    encoded = PathCodec.encode_varints(values)
+    assert len(encoded) == 1 + 1 + 1 + 2 + 2 + 5 + 10
+    np.testing.assert_array_equal(PathCodec.decode_varints(encoded), values)
+    assert len(PathCodec.decode_varints(PathCodec.encode_varints([]))) == 0
+
+
+def test_zigzag_round_trip():
+    values = np.array([0, -1, 1, -2, 2, -2**62, 2**62, -2**63, 2**63 - 1])
+    zigzagged = PathCodec.zigzag(values)
+    assert list(zigzagged[:5]) == [0, 1, 2, 3, 4]
+    np.testing.assert_array_equal(PathCodec.unzigzag(zigzagged), values)
+
+
+@pytest.mark.parametrize('compressor', ['zlib', 'lzma'])
+@pytest.mark.parametrize('precision', [1e-3, 1e-2])
+def test_quantized_round_trip(compressor, precision):
+    arrays = pack_paths(make_paths())
+    decoded = PathCodec.decode_paths(PathCodec.encode_paths(
+        arrays, precision=precision, compressor=compressor))
+    np.testing.assert_array_equal(decoded['offsets'], arrays['offsets'])
+    np.testing.assert_array_equal(decoded['mstime'], arrays['mstime'])
+    for key in ['x', 'y', 'heading']:
+        assert decoded[key].dtype == np.float64
+        np.testing.assert_allclose(decoded[key], arrays[key],
+                                   rtol=0, atol=precision / 2 + 1e-9)
+
+
+def test_float32_round_trip():
+    arrays = pack_paths(make_paths())
+    decoded = PathCodec.decode_paths(PathCodec.encode_paths(
+        arrays, precision=None, compressor='zlib'))
+    np.testing.assert_array_equal(decoded['mstime'], arrays['mstime'])
+    for key in ['x', 'y', 'heading']:
+        np.testing.assert_array_equal(decoded[key],
+                                      arrays[key].astype(np.float32))
+
+
+
+def test_unquantizable_streams_fall_back():
+    arrays = pack_paths(make_paths())
+    arrays['x'][3] = np.nan
+    arrays['y'][5] = 1e17 # too big for int64 at 1e-3
+    arrays['heading'][7] = -np.inf
+    decoded = PathCodec.decode_paths(PathCodec.encode_paths(
+        arrays, precision=1e-3, compressor='zlib'))
+    for key in ['x', 'y', 'heading']:
+        # each stream is float32 now, and the samples after the bad
+        # one aren't thrown off
+        np.testing.assert_array_equal(decoded[key],
+                                      arrays[key].astype(np.float32))
+    arrays = pack_paths(make_paths())
+    arrays['y'][5] = np.nan
+    decoded = PathCodec.decode_paths(PathCodec.encode_paths(
+        arrays, precision=1e-3, compressor='zlib'))
+    # only the bad stream falls back
+    assert decoded['x'].dtype == np.float64
+    np.testing.assert_allclose(decoded['x'], arrays['x'], rtol=0, atol=1e-3)
+    assert np.isnan(decoded['y'][5])
+    np.testing.assert_array_equal(decoded['y'][6:], arrays['y'][6:].astype(np.float32))
+
+@pytest.mark.parametrize('lengths', [(), (0, 0, 0)])
+def test_empty_sessions(lengths):
+    arrays = pack_paths(make_paths(lengths))
+    for precision in [1e-3, None]:
+        decoded = PathCodec.decode_paths(PathCodec.encode_paths(
+            arrays, precision=precision, compressor='zlib'))
+        np.testing.assert_array_equal(decoded['offsets'], arrays['offsets'])
+        assert all(len(decoded[key]) == 0
+                   for key in ['mstime', 'x', 'y', 'heading'])
+
+
+def test_save_and_load(tmp_path):
+    paths = make_paths()
+    offsets = PathCodec.save_compressed_paths(paths, f'{tmp_path}/paths.thp',
+                                              precision=None)
+    store = PathCodec.load_compressed_paths(f'{tmp_path}/paths.thp')
+    assert list(offsets) == list(store.offsets)
+    assert [len(path) for path in store.paths()] == [50, 0, 20]
+    assert list(store[0])[0]['mstime'] == paths[0][0]['mstime']
+
+
+def test_bad_data():
+    with pytest.raises(ValueError):
+        PathCodec.decode_paths(b'nope' + bytes(10))
+    with pytest.raises(ValueError):
+        PathCodec.encode_paths(pack_paths(make_paths()), compressor='gzip')
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+
+import numpy as np
+
+from th_eventreader.PathStore import (EventPath, save_paths, load_paths,
+                                      pack_paths, offsets_checksum)
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+def make_paths():
+    return [[{'mstime': 1000 + i, 'x': 0.5 * i, 'y': 2.0, 'heading': 90.0}
+             for i in range(n)] for n in [3, 0, 2]]
+
+
+def test_round_trip(tmp_path):
+    paths = make_paths()
+    offsets = save_paths(paths, f'{tmp_path}/paths')
+    store = load_paths(f'{tmp_path}/paths')
+    assert len(store) == 3
+    assert [list(path) for path in store.paths()] == paths
+    assert isinstance(store[0].x, np.memmap)
+    assert not store[0].x.flags.writeable
+    assert store.checksum() == offsets_checksum(offsets)
+    # pickles as the plain list of dicts
+    assert pickle.loads(pickle.dumps(store[2])) == paths[2]
+
+
+def test_one_mapping_per_store(tmp_path):
+    save_paths(make_paths(), f'{tmp_path}/paths')
+    store = load_paths(f'{tmp_path}/paths')
+    assert sorted(os.listdir(f'{tmp_path}/paths')) == ['offsets.npy', 'samples.npy']
+    mappings = {id(store.arrays[key]._mmap) for key in
+                ['mstime', 'x', 'y', 'heading']}
+    assert len(mappings) == 1
+    assert not isinstance(store.offsets, np.memmap)
+
+
+def test_save_over_existing(tmp_path):
+    save_paths(make_paths(), f'{tmp_path}/paths')
+    old = load_paths(f'{tmp_path}/paths')
+    new_paths = make_paths()[:2]
+    save_paths(new_paths, f'{tmp_path}/paths')
+    assert [list(path) for path in load_paths(f'{tmp_path}/paths').paths()] == new_paths
+    # the old store can still be read by whoever had it open
+    assert list(old[0]) == make_paths()[0]
+    assert os.listdir(tmp_path) == ['paths']
+
+
+def test_pack_event_paths():
+    store_arrays = pack_paths(make_paths())
+    paths = [EventPath(*(store_arrays[key][start:stop]
+                         for key in ['mstime', 'x', 'y', 'heading']))
+             for start, stop in zip(store_arrays['offsets'][:-1],
+                                    store_arrays['offsets'][1:])]
+    repacked = pack_paths(paths)
+    for key, arr in store_arrays.items():
+        np.testing.assert_array_equal(repacked[key], arr)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+import numpy as np
+import pandas as pd
+
+pytest.importorskip('cmlreaders')
+pytest.importorskip('matplotlib')
+from th_eventreader import TH_EventReader as ereader
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+def make_exp_df(n=20):
+    return pd.DataFrame({'subj': [f'R{1000 + i}' for i in range(n)],
+                         'montage': [i % 2 for i in range(n)],
+                         'session': [i % 3 for i in range(n)],
+                         'exp': 'TH1'},
+                        index=np.arange(n) * 3)
+
+
+def test_shard_sessions_disjoint_and_complete():
+    df = make_exp_df()
+    sizes = pd.Series(np.random.default_rng(0).integers(1, 1000, len(df)),
+                      index=df.index)
+    shards = [ereader.shard_sessions(df, sizes, i, 4) for i in range(4)]
+    indices = [i for shard in shards for i in shard.index]
+    assert sorted(indices) == sorted(df.index)
+    loads = [sizes[shard.index].sum() for shard in shards]
+    # greedy balancing is within one session of even
+    assert max(loads) - min(loads) <= sizes.max()
+
+
+def test_shard_sessions_deterministic():
+    df = make_exp_df()
+    sizes = pd.Series(1, index=df.index)
+    first = ereader.shard_sessions(df, sizes, 1, 3)
+    again = ereader.shard_sessions(df.sample(frac=1, random_state=1),
+                                   sizes, 1, 3)
+    assert sorted(first.index) == sorted(again.index)
+    with pytest.raises(ValueError):
+        ereader.shard_sessions(df, sizes, 3, 3)
+
+
+def test_parse_shard(monkeypatch):
+    for var in ['TH_SHARD', 'TH_NSHARDS', 'SLURM_ARRAY_TASK_ID',
+                'SLURM_ARRAY_TASK_COUNT', 'SLURM_ARRAY_TASK_MIN']:
+        monkeypatch.delenv(var, raising=False)
+    assert ereader.parse_shard() == (0, 1)
+    assert ereader.parse_shard('2/4') == (2, 4)
+    monkeypatch.setenv('SLURM_ARRAY_TASK_ID', '3')
+    monkeypatch.setenv('SLURM_ARRAY_TASK_COUNT', '4')
+    monkeypatch.setenv('SLURM_ARRAY_TASK_MIN', '1')
+    assert ereader.parse_shard() == (2, 4)
+    with pytest.raises(ValueError):
+        ereader.parse_shard('4/4')
+
+
+def write_manifest(manifest_dir, run_id, shard, n_shards, statuses,
+                   plan='plan', first=None):
+    first = shard * len(statuses) if first is None else first
+    sessions = [{'subj': f'R{1000 + first + i}', 'montage': 0, 'session': 0,
+                 'exp': 'TH1', 'status': status, 'seconds': 1.0}
+                for i, status in enumerate(statuses)]
+    with open(manifest_dir + f'shard_{shard}_of_{n_shards}.json', 'w') as f:
+        json.dump({'exp': 'TH1', 'run_id': run_id, 'shard': shard,
+                   'n_shards': n_shards, 'plan': plan, 'seconds': 2.0,
+                   'sessions': sessions}, f)
+
+
+@pytest.fixture
+def manifest_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(ereader, 'get_data_dir', lambda: f'{tmp_path}/')
+    df = make_exp_df(4)
+    df['montage'] = 0
+    df['session'] = 0
+    monkeypatch.setattr(ereader, 'exp_df', lambda exp='TH1': df)
+
+
+def test_merge_manifests_one_run(manifest_env):
+    for shard in range(2):
+        write_manifest(ereader.get_manifest_dir('TH1', 'old'), 'old',
+                       shard, 2, ['success', 'failed'])
+    write_manifest(ereader.get_manifest_dir('TH1', 'new'), 'new',
+                   0, 2, ['success', 'success'])
+    
+    report = ereader.merge_manifests('TH1', 'new')
+    assert report['missing_shards'] == [1]
+    assert report['n_sessions'] == 2
+    assert report['n_failed'] == 0
+    assert len(report['uncovered_sessions']) == 2
+    assert not report['complete']
+    
+    report = ereader.merge_manifests('TH1', 'old')
+    assert report['missing_shards'] == []
+    assert report['n_success'] == 2
+    assert report['n_failed'] == 2
+    assert report['complete']
+
+
+def test_merge_manifests_finds_disagreeing_shards(manifest_env):
+    manifest_dir = ereader.get_manifest_dir('TH1', 'run')
+    # shard 1 split the sessions differently and redid one of shard 0's
+    write_manifest(manifest_dir, 'run', 0, 2, ['success', 'success'])
+    write_manifest(manifest_dir, 'run', 1, 2, ['success'], plan='other', first=1)
+    
+    report = ereader.merge_manifests('TH1', 'run')
+    assert report['missing_shards'] == []
+    assert not report['plans_agree']
+    assert report['duplicated_sessions'] == [('R1001', 0, 0, 'TH1')]
+    assert report['uncovered_sessions'] == [('R1002', 0, 0, 'TH1'),
+                                            ('R1003', 0, 0, 'TH1')]
+    assert not report['complete']
+
+
+def test_plan_hash():
+    df = make_exp_df()
+    sizes = pd.Series(1, index=df.index)
+    assert (ereader.plan_hash(df, sizes)
+            == ereader.plan_hash(df.sample(frac=1, random_state=1), sizes))
+    sizes[df.index[0]] = 2
+    assert ereader.plan_hash(df, sizes) != ereader.plan_hash(df, sizes * 0 + 1)
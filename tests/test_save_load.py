@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+import numpy as np
+import pandas as pd
+
+pytest.importorskip('cmlreaders')
+pytest.importorskip('matplotlib')
+from th_eventreader import TH_EventReader as ereader
+from th_eventreader.PathStore import save_paths
+from th_eventreader.SessionCache import SessionCache
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+key = ('R1000T', 0, 0, 'TH1')
+
+
+def make_events(n=10):
+    return pd.DataFrame({
+        'mstime': np.arange(n) * 1000,
+        'pathInfo': [[{'mstime': i * 1000 + j, 'x': float(j), 'y': 2.0 * i,
+                       'heading': 0.5} for j in range(i + 1)]
+                     for i in range(n)]})
+
+
+@pytest.fixture
+def data_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(ereader, 'get_data_dir', lambda: f'{tmp_path}/')
+    monkeypatch.setattr(ereader, 'session_cache', SessionCache(2**30))
+    reads = []
+    read_events = ereader._read_events
+    def counting_read(*args, **kwargs):
+        reads.append(args[:4])
+        return read_events(*args, **kwargs)
+    monkeypatch.setattr(ereader, '_read_events', counting_read)
+    return reads
+
+
+def test_cache_hit_skips_disk(data_env):
+    ereader.save_events(make_events(), *key)
+    first = ereader.load_events(*key)
+    again = ereader.load_events(*key)
+    assert data_env == [key]
+    assert again['pathInfo'][4][2] == first['pathInfo'][4][2]
+    assert ereader.get_events(*key) is not None
+    assert data_env == [key]
+    assert ereader.session_cache.hits == 2
+
+
+def test_save_invalidates_cache(data_env):
+    ereader.save_events(make_events(), *key)
+    ereader.load_events(*key)
+    assert key in ereader.session_cache
+    ereader.save_events(make_events(5), *key)
+    assert key not in ereader.session_cache
+    assert len(ereader.load_events(*key)) == 5
+    assert data_env == [key, key]
+
+
+def test_cache_off_bypasses(data_env):
+    ereader.save_events(make_events(), *key)
+    ereader.load_events(*key, cache=False)
+    ereader.load_events(*key, cache=False)
+    assert data_env == [key, key]
+    assert len(ereader.session_cache) == 0
+    assert ereader.session_cache.hits + ereader.session_cache.misses == 0
+
+
+def assert_same_paths(loaded, events):
+    assert len(loaded) == len(events)
+    for got, path in zip(loaded['pathInfo'], events['pathInfo']):
+        assert len(got) == len(path)
+        for got_point, point in zip(got, path):
+            assert got_point == pytest.approx(point)
+
+
+def test_switching_path_formats(data_env):
+    events = make_events()
+    paths_dir = ereader.get_paths_dirname(*key)
+    paths_fname = ereader.get_compressed_paths_name(*key)
+    for path_format in ['npy', 'compressed', 'npy']:
+        ereader.save_events(events, *key, path_format=path_format)
+        assert os.path.isdir(paths_dir) == (path_format == 'npy')
+        assert os.path.exists(paths_fname) == (path_format == 'compressed')
+        loaded = ereader.load_events(*key, cache=False)
+        assert_same_paths(loaded, events)
+        assert 'paths' not in loaded.attrs
+    assert 'paths' not in events.attrs
+
+
+def test_mismatched_paths_raise(data_env):
+    ereader.save_events(make_events(), *key, path_format='npy')
+    # same number of events, but not the paths they were saved with
+    save_paths(make_events()['pathInfo'][::-1], ereader.get_paths_dirname(*key))
+    with pytest.raises(ValueError):
+        ereader.load_events(*key, cache=False)
+
+
+def test_legacy_pickle(data_env):
+    events = make_events()
+    events.to_pickle(ereader.get_savename(*key))
+    loaded = ereader.load_events(*key, cache=False)
+    assert_same_paths(loaded, events)
+    assert isinstance(loaded['pathInfo'][0], list)
+
+
+def test_without_paths(data_env):
+    ereader.save_events(make_events(), *key)
+    events = make_events().drop(columns='pathInfo')
+    ereader.save_events(events, *key)
+    # the old paths went with the old events
+    assert not os.path.exists(ereader.get_paths_dirname(*key))
+    loaded = ereader.load_events(*key, cache=False)
+    assert 'pathInfo' not in loaded
+    assert (loaded['mstime'] == events['mstime']).all()
+    assert data_env == [key] # found first time
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+import pandas as pd
+
+from th_eventreader.SessionCache import SessionCache, events_nbytes, freeze_events
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+
+def make_events(n=50):
+    return pd.DataFrame({
+        'mstime': np.arange(n),
+        'pathInfo': [[{'mstime': i, 'x': 1.0, 'y': 2.0, 'heading': 3.0}] * 5
+                     for i in range(n)]})
+
+
+def test_events_nbytes_counts_paths():
+    events = make_events()
+    assert events_nbytes(events) > events_nbytes(events.drop(columns='pathInfo'))
+
+
+def test_lru_eviction():
+    events = make_events()
+    # the cache holds and counts events in their frozen form
+    cache = SessionCache(int(events_nbytes(freeze_events(events)) * 2.5))
+    cache.put('a', events)
+    cache.put('b', events)
+    assert cache.get('a') is not None # now 'b' is least recently used
+    cache.put('c', events)
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['nbytes'] <= stats['max_bytes']
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_too_big_not_cached():
+    events = make_events()
+    cache = SessionCache(events_nbytes(freeze_events(events)) - 1)
+    cache.put('a', events)
+    assert len(cache) == 0
+
+
+def test_copies_are_isolated():
+    events = make_events()
+    cache = SessionCache(2**30)
+    cache.put('a', events)
+    # changing what was put in doesn't change the cache
+    events.loc[0, 'mstime'] = -1
+    events['pathInfo'][0][0]['x'] = -1.0
+    got = cache.get('a')
+    assert got.loc[0, 'mstime'] == 0
+    assert got['pathInfo'][0][0]['x'] == 1.0
+    # nor does changing what came out
+    got.loc[0, 'mstime'] = -2
+    got['pathInfo'][0][0]['x'] = -2.0
+    again = cache.get('a')
+    assert again.loc[0, 'mstime'] == 0
+    assert again['pathInfo'][0][0]['x'] == 1.0
+
+
+def test_resize_and_invalidate():
+    events = make_events()
+    cache = SessionCache(2**30)
+    for key in 'abc':
+        cache.put(key, events)
+    cache.invalidate('a')
+    assert 'a' not in cache
+    cache.resize(events_nbytes(freeze_events(events)))
+    assert list(cache._entries) == ['c']
+
+
+def test_paths_are_shared_read_only():
+    events = make_events()
+    cache = SessionCache(2**30)
+    cache.put('a', events)
+    got, again = cache.get('a'), cache.get('a')
+    assert got['pathInfo'][3] is again['pathInfo'][3]
+    assert got['pathInfo'][3].x[0] == 1.0
+    with pytest.raises(ValueError):
+        got['pathInfo'][3].x[0] = -1.0
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import signal
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from th_eventreader import SessionServer
+
+__author__ = "Shai"
+__copyright__ = "Shai"
+__license__ = "mit"
+
+pytestmark = pytest.mark.skipif(SessionServer._posixshmem is None,
+                                reason='needs POSIX shared memory')
+mp = multiprocessing.get_context('fork')
+
+
+def fake_loader(subj, montage, session, exp):
+    n = 1000
+    return pd.DataFrame({
+        'mstime': np.arange(n) + session,
+        'type': ['CHEST'] * n,
+        'pathInfo': [[{'mstime': i, 'x': 1.0 * i, 'y': 2.0, 'heading': 3.0}] * 2
+                     for i in range(n)]})
+
+
+@pytest.fixture
+def address(tmp_path):
+    address = f'{tmp_path}/server.sock'
+    server = mp.Process(target=SessionServer.serve, args=(address,),
+                        kwargs={'max_bytes': 150_000, 'loader': fake_loader})
+    server.start()
+    for i in range(100):
+        if os.path.exists(address):
+            break
+        time.sleep(0.05)
+    yield address
+    server.terminate()
+    server.join()
+
+
+def get_and_release(address, release=True):
+    events = SessionServer.get_events('R1001P', 0, 0, 'TH1', address=address)
+    assert len(events) == 1000
+    if release:
+        SessionServer.release('R1001P', 0, 0, 'TH1', address=address)
+    os._exit(0)
+
+
+def refs(address):
+    return SessionServer.SessionClient(address).stats()['sessions']
+
+
+def test_events_are_shared_read_only(address):
+    events = SessionServer.get_events('R1001P', 0, 3, 'TH1', address=address)
+    pd.testing.assert_frame_equal(events.drop(columns='pathInfo'),
+                                  fake_loader('R1001P', 0, 3, 'TH1')
+                                  .drop(columns='pathInfo'))
+    assert list(events['pathInfo'][5]) == fake_loader('R1001P', 0, 3, 'TH1')['pathInfo'][5]
+    assert not events['mstime'].values.flags.writeable
+    with pytest.raises(ValueError):
+        events['mstime'].values[0] = 5
+
+
+def test_release_with_explicit_address(address):
+    for i in range(2):
+        SessionServer.get_events('R1001P', 0, 0, 'TH1', address=address)
+    assert refs(address)[('R1001P', 0, 0, 'TH1')] == 2
+    for i in range(2):
+        SessionServer.release('R1001P', 0, 0, 'TH1', address=address)
+    assert refs(address)[('R1001P', 0, 0, 'TH1')] == 0
+    
+    clients = [mp.Process(target=get_and_release, args=(address,))
+               for i in range(3)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+        assert client.exitcode == 0
+    assert refs(address)[('R1001P', 0, 0, 'TH1')] == 0
+
+
+def test_dead_clients_dont_pin_sessions(address):
+    client = mp.Process(target=get_and_release, args=(address, False))
+    client.start()
+    client.join()
+    assert refs(address)[('R1001P', 0, 0, 'TH1')] == 0
+    # over budget, so the session the dead client held can go
+    for session in range(1, 4):
+        SessionServer.get_events('R1001P', 0, session, 'TH1', address=address)
+        SessionServer.release('R1001P', 0, session, 'TH1', address=address)
+    stats = SessionServer.SessionClient(address).stats()
+    assert ('R1001P', 0, 0, 'TH1') not in stats['sessions']
+    assert stats['evictions'] > 0
+
+
+def test_no_server(tmp_path):
+    assert SessionServer.get_client(f'{tmp_path}/nothing.sock') is None
+
+
+def test_server_wont_replace_a_live_one(address, tmp_path):
+    assert SessionServer.server_running(address)
+    with pytest.raises(RuntimeError):
+        SessionServer.serve(address)
+    assert refs(address) == {}
+    # but a socket left behind by a dead server is replaced
+    stale = f'{tmp_path}/stale.sock'
+    for kill in [True, False]:
+        server = mp.Process(target=SessionServer.serve, args=(stale,))
+        server.start()
+        for i in range(100):
+            if SessionServer.server_running(stale):
+                break
+            time.sleep(0.05)
+        assert SessionServer.server_running(stale)
+        if kill:
+            os.kill(server.pid, signal.SIGKILL)
+            server.join()
+            assert os.path.exists(stale)
+            assert not SessionServer.server_running(stale)
+    server.terminate()
+    server.join()
+
+
+def test_authkey(address):
+    key_fname = address + '.key'
+    assert os.stat(key_fname).st_mode & 0o777 == 0o600
+    assert len(SessionServer.get_authkey(address)) == 64
+    assert SessionServer.get_client(address) is not None
+    # a client with the wrong key falls back to loading directly
+    assert SessionServer.get_client(address, authkey=b'wrong') is None